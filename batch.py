@@ -0,0 +1,39 @@
+import io
+from interpreter import Interpreter
+from program_io import BatchIO
+from workers import make_pool, shared
+
+def run_one(inputs, program, max_steps=None, max_time=None):
+    # run the program on one input vector, hand back what it printed - or
+    # the error that stopped it, with what it printed before as .output
+    stdin = io.StringIO(''.join(f'{value}\n' for value in inputs))
+    stdout = io.StringIO()
+    try:
+        Interpreter(program, io=BatchIO(stdin, stdout), max_steps=max_steps, max_time=max_time).run()
+    except Exception as error:
+        error.output = stdout.getvalue().splitlines()
+        return error
+    return stdout.getvalue().splitlines()
+
+def _run_shared(inputs):
+    program, max_steps, max_time = shared()
+    return run_one(inputs, program, max_steps, max_time)
+
+def run_batch(ast, input_vectors, processes=None, chunksize=16, max_steps=None, max_time=None):
+    # yields the captured output lines of every input vector, in order,
+    # as soon as they are ready. a vector that fails yields its error
+    # instead (like scheduler.run_all), the others carry on. the budgets
+    # apply to every vector on its own
+    if processes == 1:
+        for inputs in input_vectors:
+            yield run_one(inputs, ast, max_steps, max_time)
+        return
+    with make_pool((ast, max_steps, max_time), processes) as pool:
+        yield from pool.imap(_run_shared, input_vectors, chunksize)
+
+def read_input_vectors(path):
+    # one vector per line, values separated by spaces or commas
+    with open(path, 'r') as f:
+        for line in f:
+            if line.strip():
+                yield [int(value) for value in line.replace(',', ' ').split()]
@@ -0,0 +1,51 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# wall clock of whole CLI runs, the way CI calls us: python startup,
+# imports and the actual work. run it with: python bench_startup.py
+HERE = os.path.dirname(os.path.abspath(__file__))
+COMPILER = os.path.join(HERE, 'compiler.py')
+SOURCE = os.path.join(HERE, 'test.src')
+
+def measure(args, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, COMPILER] + args, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append((time.perf_counter() - start) * 1000)
+    return min(times), statistics.median(times)
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup benchmark for compiler.py')
+    parser.add_argument('--runs', type=int, default=20, help='Runs per case')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cases = [
+            ('python only', None),
+            ('--help', ['--help']),
+            ('compile test.src', [SOURCE, '-o', os.path.join(tmp, 'out.c')]),
+            ('interpret test.src', [SOURCE, '--interpret']),
+        ]
+        print(f"{'case':<20} {'min ms':>8} {'median ms':>10}")
+        for name, case_args in cases:
+            if case_args is None:
+                # baseline: bare interpreter start, nothing of ours imported
+                times = []
+                for _ in range(args.runs):
+                    start = time.perf_counter()
+                    subprocess.run([sys.executable, '-c', 'pass'], check=True)
+                    times.append((time.perf_counter() - start) * 1000)
+                best, median = min(times), statistics.median(times)
+            else:
+                best, median = measure(case_args, args.runs)
+            print(f"{name:<20} {best:>8.1f} {median:>10.1f}")
+
+if __name__ == '__main__':
+    main()
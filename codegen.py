@@ -1,25 +1,25 @@
-import os
-import sys
-
-# Print current directory and files
-print("Current directory:", os.getcwd())
-print("Files in directory:", os.listdir())
-
-try:
-    from lexer import Lexer, Token
-    from parser import Parser
-except ImportError as e:
-    print("Import error:", e)
-    sys.exit(1)
+from profiler import find_blocks, format_instruction
+from semantics import BINARY_OPS, C_OPERATIONS, DIV_ZERO, UNARY_OPS
+from workers import make_pool, shared, split_chunks
 
 class CCodeGenerator:
-    def __init__(self, ast):
+    def __init__(self, ast, io_mode='interactive', jobs=1, chunk_size=20000, dump_state=False,
+                 profile=None, sample_interval=0):
         self.ast = ast
+        self.profile = profile  # file the binary writes its profile report to at exit (None = off)
+        self.sample_interval = sample_interval  # SIGPROF sampling every N microseconds (0 = off, needs profile)
+        self.blocks = {}  # leader instruction number -> basic block counter, when profiling
+        self.dump_state = dump_state  # print variables and flags to stderr at exit (for fuzz.py)
+        self.jobs = jobs  # worker processes for big programs (None = all cores)
+        self.chunk_size = chunk_size  # instructions per worker task
+        self.io_mode = io_mode  # interactive, batch or binary - see program_io.py
         self.variables = {}  # Track variable types
         self.indent_level = 0
         self.output = []
         self.labels = set()  # Track used labels
         self.current_instruction = 0  # Track instruction numbers for labels
+        self.routines = [node['name'] for node in ast if node['type'] == 'label']
+        self.current_routine = None  # None while generating main
         
     def indent(self):
         return "    " * self.indent_level
@@ -30,6 +30,7 @@ class CCodeGenerator:
             "#include <stdio.h>",
             "#include <stdlib.h>",
             "#include <stdint.h>",
+            *(["#include <signal.h>", "#include <sys/time.h>"] if self.profile and self.sample_interval else []),
             "",
             "// Flags",
             "int8_t ZF = 0, SF = 0, OF = 0;",
@@ -55,32 +56,273 @@ class CCodeGenerator:
             "    return stack[--stack_pointer];",
             "}",
             "",
-            "void update_flags(int value) {",
-            "    ZF = (value == 0);",
-            "    SF = (value < 0);",
-            "    OF = (value < -127 || value > 128);",
-            "}",
-            "",
-            "int main(void) {",
         ]
-        self.indent_level = 1
+        self.output.extend(self.arithmetic_helpers())
+        self.output.extend(self.io_helpers())
+        self.output.append("")
+        if self.routines:
+            self.output.extend(self.call_helpers())
+            self.output.append("")
         
-        # Process declarations
+        # Process declarations - file scope so routines can see them too
+        self.output.append("// Variables")
         self.process_declarations()
         self.output.append("")
+        if self.dump_state:
+            self.output.extend(self.state_dump())
+            self.output.append("")
+        if self.profile:
+            self.blocks = {leader: block for block, leader in enumerate(find_blocks(self.ast))}
+            self.output.extend(self.profile_helpers())
+            self.output.append("")
         
-        # Process instructions
+        self.output.append("int main(void) {")
+        self.indent_level = 1
+        if self.arithmetic_ops():
+            self.output.append(f"{self.indent()}init_tables();")
+        if self.dump_state:
+            self.output.append(f"{self.indent()}atexit(dump_state);")
+        if self.profile:
+            self.output.append(f"{self.indent()}atexit(dump_profile);")
+            if self.sample_interval:
+                self.output.append(f"{self.indent()}start_sampling();")
+        if self.io_mode != 'interactive':
+            # block buffered output, flushed on halt/exit
+            self.output.append(f"{self.indent()}setvbuf(stdout, NULL, _IOFBF, 1 << 16);")
+        
+        # Process instructions (closes main and every routine function)
         self.process_instructions()
         
-        # Add return statement and closing brace
-        self.output.extend([
+        return "\n".join(self.output)
+    
+    def arithmetic_helpers(self):
+        # the lookup tables from semantics.py, only for the opcodes this
+        # program uses. init_tables() fills them at startup with a C copy
+        # of semantics.make_entry, which keeps the source small
+        used = self.arithmetic_ops()
+        if not used:
+            return []
+        binary = [command for command in used if command in BINARY_OPS]
+        unary = [command for command in used if command in UNARY_OPS]
+        lines = [
+            "// Arithmetic: result | ZF << 8 | SF << 9 | OF << 10, see semantics.py",
+            f"#define DIV_ZERO 0x{DIV_ZERO:x}",
+            *[f"uint16_t {command}_table[65536];" for command in binary],
+            *[f"uint16_t {command}_table[256];" for command in unary],
+            "",
+            "uint16_t make_entry(int exact) {",
+            "    int result = ((exact + 128) & 0xff) - 128;",
+            "    return (uint16_t)((result & 0xff) | (result == 0) << 8 | (result < 0) << 9 | (result != exact) << 10);",
+            "}",
+            "",
+            "void init_tables(void) {",
+            "    for (int a = -128; a < 128; a++) {",
+        ]
+        if binary:
+            lines.append("        for (int b = -128; b < 128; b++) {")
+            lines.append("            int index = (uint8_t)a << 8 | (uint8_t)b;")
+            for command in binary:
+                entry = f"make_entry({C_OPERATIONS[command]})"
+                if command == 'div':
+                    entry = f"b ? {entry} : DIV_ZERO"
+                lines.append(f"            {command}_table[index] = {entry};")
+            lines.append("        }")
+        for command in unary:
+            lines.append(f"        {command}_table[(uint8_t)a] = make_entry({C_OPERATIONS[command]});")
+        lines.extend([
+            "    }",
+            "}",
             "",
-            "    return 0;",
+            "void apply_entry(int8_t *dest, uint16_t entry) {",
+            "    if (entry & DIV_ZERO) {",
+            "        printf(\"Division by zero\\n\");",
+            "        exit(1);",
+            "    }",
+            "    *dest = (int8_t)(entry & 0xff);",
+            "    ZF = (entry >> 8) & 1;",
+            "    SF = (entry >> 9) & 1;",
+            "    OF = (entry >> 10) & 1;",
             "}",
+            "",
+            "#define BINARY_OP(table, dest, src) apply_entry(&(dest), table[(uint8_t)(dest) << 8 | (uint8_t)(src)])",
+            "#define UNARY_OP(table, dest) apply_entry(&(dest), table[(uint8_t)(dest)])",
+            "",
         ])
-        
-        return "\n".join(self.output)
+        return lines
+    
+    def arithmetic_ops(self):
+        return sorted({node['command'] for node in self.ast if node['type'] == 'instruction'
+                       and (node['command'] in BINARY_OPS or node['command'] in UNARY_OPS)})
+    
+    def call_helpers(self):
+        # bounded call depth plus one prototype per routine
+        return [
+            "// Call stack",
+            "#define CALL_STACK_SIZE 256",
+            "int call_depth = 0;",
+            "",
+            "void call_enter(void) {",
+            "    if (call_depth >= CALL_STACK_SIZE) {",
+            "        printf(\"Call stack overflow\\n\");",
+            "        exit(1);",
+            "    }",
+            "    call_depth++;",
+            "}",
+            "",
+            *[f"void routine_{name}(void);" for name in self.routines],
+        ]
+    
+    def close_function(self):
+        # end of main or of the routine being generated
+        if self.current_routine is None:
+            self.output.extend([
+                "",
+                "    fflush(stdout);",
+                "    return 0;",
+                "}",
+            ])
+        else:
+            self.output.append("}")
+    
+    def state_dump(self):
+        # same text as fuzz.interpreter_state: one line per variable, then the flags
+        lines = ["void dump_state(void) {"]
+        for name, var_type in self.variables.items():
+            if var_type == 'byte':
+                lines.append(f"    fprintf(stderr, \"{name}=%d\\n\", v_{name});")
+            else:
+                lines.extend([
+                    f"    fprintf(stderr, \"{name}=\");",
+                    f"    for (int i = 0; i < {var_type[1]}; i++) fprintf(stderr, i ? \",%d\" : \"%d\", v_{name}[i]);",
+                    "    fprintf(stderr, \"\\n\");",
+                ])
+        lines.extend([
+            "    fprintf(stderr, \"ZF=%d SF=%d OF=%d\\n\", ZF, SF, OF);",
+            "}",
+        ])
+        return lines
+    
+    def profile_helpers(self):
+        # one counter per basic block, bumped when the block is entered, and
+        # dump_profile() to spread them back over the instructions at exit -
+        # same report as profiler.format_profile. a block that dies halfway
+        # (stack overflow, no input, ...) is still counted in full
+        instructions = [node for node in self.ast if node['type'] == 'instruction']
+        block_of = []
+        for number in range(len(instructions)):
+            block_of.append(self.blocks[number] if number in self.blocks else block_of[-1])
+        sources = [format_instruction(node).replace('\\', '\\\\').replace('"', '\\"') for node in instructions]
+        path = self.profile.replace('\\', '\\\\').replace('"', '\\"')
+        sampling = bool(self.sample_interval)
+        lines = [
+            "// Profile",
+            f"#define PROFILE_BLOCKS {len(self.blocks)}",
+            f"#define PROFILE_INSTRUCTIONS {len(instructions)}",
+            "unsigned long long block_counts[PROFILE_BLOCKS + 1];",
+            f"static const int block_of[PROFILE_INSTRUCTIONS + 1] = {{{', '.join(map(str, block_of + [0]))}}};",
+            "static const char *instruction_source[PROFILE_INSTRUCTIONS + 1] = {",
+            *[f"    \"{source}\"," for source in sources],
+            "    \"\"",
+            "};",
+            "",
+        ]
+        if sampling:
+            seconds, microseconds = divmod(self.sample_interval, 1000000)
+            lines.extend([
+                "volatile sig_atomic_t current_block = 0;",
+                "unsigned long long block_samples[PROFILE_BLOCKS + 1];",
+                "",
+                "void profile_sample(int signum) {",
+                "    block_samples[current_block]++;",
+                "}",
+                "",
+                "void start_sampling(void) {",
+                "    struct sigaction action = {0};",
+                "    action.sa_handler = profile_sample;",
+                "    action.sa_flags = SA_RESTART;",
+                "    sigaction(SIGPROF, &action, NULL);",
+                f"    struct itimerval timer = {{{{{seconds}, {microseconds}}}, {{{seconds}, {microseconds}}}}};",
+                "    setitimer(ITIMER_PROF, &timer, NULL);",
+                "}",
+                "",
+            ])
+        lines.extend([
+            "void dump_profile(void) {",
+            f"    FILE *f = fopen(\"{path}\", \"w\");",
+            "    if (!f) return;",
+            "    unsigned long long total = 0;",
+            "    for (int i = 0; i < PROFILE_INSTRUCTIONS; i++) total += block_counts[block_of[i]];",
+        ])
+        if sampling:
+            lines.extend([
+                "    unsigned long long samples = 0;",
+                "    for (int b = 0; b < PROFILE_BLOCKS; b++) samples += block_samples[b];",
+                "    fprintf(f, \"Profile: %llu instructions executed, %llu samples\\n\", total, samples);",
+                "    fprintf(f, \"%8s %10s %10s  source\\n\", \"instr\", \"count\", \"samples\");",
+            ])
+        else:
+            lines.extend([
+                "    fprintf(f, \"Profile: %llu instructions executed\\n\", total);",
+                "    fprintf(f, \"%8s %10s  source\\n\", \"instr\", \"count\");",
+            ])
+        lines.extend([
+            "    for (int i = 0; i < PROFILE_INSTRUCTIONS; i++) {",
+            "        unsigned long long count = block_counts[block_of[i]];",
+            "        if (!count) continue;",
+        ])
+        if sampling:
+            lines.extend([
+                "        // samples go on the first instruction of their block",
+                "        int leader = i == 0 || block_of[i] != block_of[i - 1];",
+                "        fprintf(f, \"%8d %10llu %10llu  %s\\n\", i, count,",
+                "                leader ? block_samples[block_of[i]] : 0ULL, instruction_source[i]);",
+            ])
+        else:
+            lines.append("        fprintf(f, \"%8d %10llu  %s\\n\", i, count, instruction_source[i]);")
+        lines.extend([
+            "    }",
+            "    fclose(f);",
+            "}",
+        ])
+        return lines
     
+    def io_helpers(self):
+        # read_input/write_output behave like the interpreter's I/O classes
+        if self.io_mode == 'interactive':
+            read = [
+                "    int8_t value;",
+                "    printf(\"Input value for %s: \", name);",
+                "    if (scanf(\"%hhd\", &value) != 1) {",
+            ]
+            write = "    printf(\"%d\\n\", value);"
+        elif self.io_mode == 'batch':
+            read = [
+                "    int8_t value;",
+                "    if (scanf(\"%hhd\", &value) != 1) {",
+            ]
+            write = "    printf(\"%d\\n\", value);"
+        elif self.io_mode == 'binary':
+            read = [
+                "    int value = getchar();",
+                "    if (value == EOF) {",
+            ]
+            write = "    putchar((uint8_t)value);"
+        else:
+            raise ValueError(f"Unknown I/O mode {self.io_mode}")
+        return [
+            "int8_t read_input(const char *name) {",
+            *read,
+            "        fprintf(stderr, \"No input left for %s\\n\", name);",
+            "        exit(1);",
+            "    }",
+            "    return (int8_t)value;",
+            "}",
+            "",
+            "void write_output(int value) {",
+            write,
+            "}",
+        ]
+
     def process_declarations(self):
         for node in self.ast:
             if node['type'] == 'declaration':
@@ -92,11 +334,11 @@ class CCodeGenerator:
         
         if var_type == 'byte':
             self.variables[var_name] = 'byte'
-            self.output.append(f"{self.indent()}int8_t {var_name} = 0;")
+            self.output.append(f"{self.indent()}int8_t {c_operand(var_name)} = 0;")
         elif var_type.startswith('Array'):
             size = int(var_type.split('[')[1].split(']')[0])
             self.variables[var_name] = ('array', size)
-            self.output.append(f"{self.indent()}int8_t {var_name}[{size}] = {{0}};")
+            self.output.append(f"{self.indent()}int8_t {c_operand(var_name)}[{size}] = {{0}};")
     
     def process_instructions(self):
         # First pass - collect all jump labels
@@ -105,55 +347,65 @@ class CCodeGenerator:
                 if node['command'] in ['jmp', 'jz', 'js', 'jo']:
                     self.labels.add(int(node['operands'][0]))
         
-        # Second pass - generate code with labels
-        for node in self.ast:
+        # Second pass - generate code with labels, every routine is its own function
+        chunks = split_chunks(self.ast, self.chunk_size)
+        if self.jobs == 1 or len(chunks) == 1:
+            self.output.extend(self.generate_range(0, len(self.ast), 0, None))
+        else:
+            # each instruction only needs the labels found above, so chunks
+            # can be generated by workers and glued back together in order
+            with make_pool(self, self.jobs) as pool:
+                for fragment in pool.imap(_generate_chunk, chunks):
+                    self.output.extend(fragment)
+            self.current_routine = ([None] + self.routines)[-1]
+        self.close_function()
+    
+    def generate_range(self, start, end, first_instruction, routine):
+        # C lines for ast[start:end], starting at that instruction number and routine
+        output = self.output
+        self.output = []
+        self.current_instruction = first_instruction
+        self.current_routine = routine
+        for node in self.ast[start:end]:
             if node['type'] == 'instruction':
                 if self.current_instruction in self.labels:
                     self.output.append(f"label_{self.current_instruction}:")
+                if self.current_instruction in self.blocks:
+                    self.profile_counter(self.blocks[self.current_instruction])
                 self.generate_instruction(node)
                 self.current_instruction += 1
+            elif node['type'] == 'label':
+                self.close_function()
+                self.current_routine = node['name']
+                self.output.extend(["", f"void routine_{node['name']}(void) {{"])
+        fragment, self.output = self.output, output
+        return fragment
+    
+    def profile_counter(self, block):
+        if self.sample_interval:
+            self.output.append(f"{self.indent()}current_block = {block};")
+        self.output.append(f"{self.indent()}block_counts[{block}]++;")
     
     def generate_instruction(self, node):
         command = node['command']
         operands = node['operands']
+        if command not in ['call', 'jmp', 'jz', 'js', 'jo']:
+            operands = [c_operand(operand) for operand in operands]
         
         if command == 'mov':
             self.output.append(f"{self.indent()}{operands[0]} = {operands[1]};")
             
-        elif command in ['add', 'sub', 'mult', 'div']:
-            ops = {
-                'add': '+',
-                'sub': '-',
-                'mult': '*',
-                'div': '/'
-            }
-            op = ops[command]
-            self.output.extend([
-                f"{self.indent()}{operands[0]} {op}= {operands[1]};",
-                f"{self.indent()}update_flags({operands[0]});"
-            ])
-            
-        elif command in ['and', 'or']:
-            op = '&' if command == 'and' else '|'
-            self.output.extend([
-                f"{self.indent()}{operands[0]} {op}= {operands[1]};",
-                f"{self.indent()}update_flags({operands[0]});"
-            ])
+        elif command in BINARY_OPS:
+            self.output.append(f"{self.indent()}BINARY_OP({command}_table, {operands[0]}, {operands[1]});")
             
-        elif command == 'not':
-            self.output.extend([
-                f"{self.indent()}{operands[0]} = ~{operands[0]};",
-                f"{self.indent()}update_flags({operands[0]});"
-            ])
+        elif command in UNARY_OPS:
+            self.output.append(f"{self.indent()}UNARY_OP({command}_table, {operands[0]});")
             
         elif command == 'print':
-            self.output.append(f"{self.indent()}printf(\"%d\\n\", {operands[0]});")
+            self.output.append(f"{self.indent()}write_output({operands[0]});")
             
         elif command == 'input':
-            self.output.append(
-                f"{self.indent()}printf(\"Input value for {operands[0]}: \");"
-                f"\n{self.indent()}scanf(\"%hhd\", &{operands[0]});"
-            )
+            self.output.append(f"{self.indent()}{operands[0]} = read_input(\"{node['operands'][0]}\");")
             
         elif command == 'push':
             self.output.append(f"{self.indent()}push({operands[0]});")
@@ -162,12 +414,24 @@ class CCodeGenerator:
             self.output.append(f"{self.indent()}{operands[0]} = pop();")
             
         elif command == 'isFull':
-            self.output.append(
-                f"{self.indent()}printf(\"%d\\n\", stack_pointer >= STACK_SIZE);"
-            )
+            self.output.append(f"{self.indent()}write_output(stack_pointer >= STACK_SIZE);")
             
-        elif command == 'halt':
-            self.output.append(f"{self.indent()}exit(0);")
+        elif command == 'halt' or (command == 'ret' and self.current_routine is None):
+            # ret from main ends the program, same as in the interpreter
+            self.output.extend([
+                f"{self.indent()}fflush(stdout);",
+                f"{self.indent()}exit(0);"
+            ])
+            
+        elif command == 'ret':
+            self.output.append(f"{self.indent()}return;")
+            
+        elif command == 'call':
+            self.output.extend([
+                f"{self.indent()}call_enter();",
+                f"{self.indent()}routine_{operands[0]}();",
+                f"{self.indent()}call_depth--;"
+            ])
             
         elif command in ['jmp', 'jz', 'js', 'jo']:
             label = f"label_{operands[0]}"
@@ -182,12 +446,25 @@ class CCodeGenerator:
             else:
                 self.output.append(f"{self.indent()}goto {label};")
 
+def c_operand(operand):
+    # user variables get a v_ prefix so they can never clash with the
+    # runtime's own names (stack, ZF, call_depth, read_input, ...)
+    if operand.lstrip('+-').isdigit():
+        return operand
+    return f"v_{operand}"
+
+def _generate_chunk(chunk):
+    return shared().generate_range(*chunk)
+
 def generate_c_code(ast):
     generator = CCodeGenerator(ast)
     return generator.generate()
 
 # Example usage
 if __name__ == '__main__':
+    from lexer import Lexer
+    from parser import Parser
+    
     code = '''
     Var x: byte, y: Array[10];
     mov x, 5;
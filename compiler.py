@@ -1,12 +1,12 @@
 import argparse
 import os
-import subprocess
-from lexer import Lexer
-from parser import Parser
-from semantic_analyzer import SemanticAnalyzer
-from codegen import CCodeGenerator
+from program_io import IO_MODES, make_io
 
-def compile_and_run(c_file):
+# the compiler stages are imported where they are used, so --help and
+# short runs only pay for what they actually touch
+
+def compile_and_run(c_file, input_file=None):
+    import subprocess
     # Compile the C file
     output_exe = c_file.replace('.c', '.exe')
     compile_result = subprocess.run(['gcc', c_file, '-o', output_exe], 
@@ -20,11 +20,16 @@ def compile_and_run(c_file):
     
     # Run the executable
     try:
-        run_result = subprocess.run([f'./{output_exe}'], 
-                                  capture_output=True, 
-                                  text=True)
+        stdin = open(input_file, 'rb') if input_file else None
+        try:
+            run_result = subprocess.run([os.path.join('.', output_exe)], 
+                                      stdin=stdin,
+                                      capture_output=True)
+        finally:
+            if stdin:
+                stdin.close()
         print("\nProgram output:")
-        print(run_result.stdout)
+        print(run_result.stdout.decode(errors='replace'))
         return True
     except Exception as e:
         print(f"Error running program: {e}")
@@ -36,14 +41,90 @@ def compile_and_run(c_file):
         except:
             pass
 
+def interpret(ast, args):
+    from interpreter import Interpreter
+    
+    if args.batch:
+        from batch import run_batch, read_input_vectors
+        if args.profile:
+            print("Error: --profile does not work with --batch")
+            return 1
+        if args.lockstep:
+            if args.max_steps is not None or args.max_time is not None:
+                print("Error: --max-steps/--max-time do not work with --lockstep")
+                return 1
+            # numpy is optional, only pull it in when asked for
+            from vector_interpreter import run_lockstep
+            results = run_lockstep(ast, read_input_vectors(args.batch))
+        else:
+            results = run_batch(ast, read_input_vectors(args.batch), processes=args.jobs,
+                                max_steps=args.max_steps, max_time=args.max_time)
+        failed = False
+        for outputs in results:
+            if isinstance(outputs, Exception):
+                # one line per vector: what it printed, then why it stopped
+                failed = True
+                outputs = outputs.output + [f'Error: {outputs}']
+            print(' '.join(outputs))
+        return 1 if failed else 0
+    
+    stdin = open(args.input_file, 'rb' if args.io == 'binary' else 'r') if args.input_file else None
+    interpreter = Interpreter(ast, debug_mode=args.debug,
+                              io=make_io(args.io, stdin),
+                              max_steps=args.max_steps,
+                              max_time=args.max_time,
+                              checkpoint_path=args.checkpoint,
+                              checkpoint_every=args.checkpoint_every,
+                              checkpoint_fork=args.checkpoint_fork,
+                              profile=bool(args.profile))
+    if args.checkpoint:
+        interpreter.checkpoint_on_signal()
+        if args.resume and os.path.exists(args.checkpoint):
+            interpreter.load_checkpoint()
+            print(f"Resuming from {args.checkpoint} at instruction {interpreter.instruction_number()}")
+    try:
+        interpreter.run()
+    finally:
+        if stdin:
+            stdin.close()
+        if args.profile:
+            # written even when the run fails, like the compiled binaries do
+            from profiler import format_profile
+            with open(args.profile, 'w') as f:
+                f.write(format_profile(ast, interpreter.profile_counts()))
+    # finished cleanly - an old snapshot would only resume a done job
+    if args.checkpoint and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    return 0
+
 def main():
     parser = argparse.ArgumentParser(description='Simple compiler')
     parser.add_argument('input', help='Input source file')
     parser.add_argument('-o', '--output', help='Output C file', default='output.c')
     parser.add_argument('--debug', action='store_true', help='Enable debug output')
     parser.add_argument('--run', action='store_true', help='Compile and run the program')
+    parser.add_argument('--io', choices=IO_MODES, default='interactive', help='How input/print talk to the outside (default: interactive)')
+    parser.add_argument('--input-file', help='Read program input from this file instead of stdin (batch/binary I/O)')
+    parser.add_argument('--cost', action='store_true', help='Print a static cost estimate (loops, instructions, stack, I/O)')
+    parser.add_argument('--max-instructions', type=int, help='Reject programs whose estimated instruction count is unbounded or above this')
+    parser.add_argument('--interpret', action='store_true', help='Run the program with the interpreter instead of compiling it')
+    parser.add_argument('--max-steps', type=int, help='Stop the interpreter after this many steps')
+    parser.add_argument('--max-time', type=float, help='Stop the interpreter after this many seconds')
+    parser.add_argument('--checkpoint', help='Snapshot file for the interpreter state')
+    parser.add_argument('--checkpoint-every', type=int, default=0, help='Write a snapshot every N instructions (0 = only on SIGUSR1)')
+    parser.add_argument('--checkpoint-fork', action='store_true', help='Write snapshots from a forked child (copy-on-write)')
+    parser.add_argument('--resume', action='store_true', help='Resume from the snapshot file if there is one')
+    parser.add_argument('--profile', help='Write an execution profile (runs per instruction) to this file, from the interpreter or the compiled binary')
+    parser.add_argument('--profile-sample', type=int, default=0, help='Compiled binaries also sample where time goes, every N microseconds of CPU time (needs --profile)')
+    parser.add_argument('--batch', help='Interpret once per input vector in this file (one vector per line)')
+    parser.add_argument('--lockstep', action='store_true', help='Run all --batch vectors at once in one vectorized pass (needs numpy)')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Worker processes for --batch and for checking/generating big programs (default: all cores)')
     args = parser.parse_args()
     
+    from lexer import Lexer
+    from parser import Parser
+    from semantic_analyzer import SemanticAnalyzer
+    
     try:
         # Read input file
         with open(args.input, 'r') as f:
@@ -61,7 +142,7 @@ def main():
             print("AST:", ast)
         
         # Semantic analysis
-        analyzer = SemanticAnalyzer(ast)
+        analyzer = SemanticAnalyzer(ast, jobs=args.jobs)
         success, errors = analyzer.analyze()
         if not success:
             print("Semantic errors:")
@@ -69,8 +150,25 @@ def main():
                 print(f"  {error}")
             return 1
         
+        # Cost estimate
+        if args.cost or args.max_instructions is not None:
+            from loop_analyzer import LoopAnalyzer, format_report
+            report = LoopAnalyzer(ast).analyze()
+            if args.cost:
+                print(format_report(report))
+            if args.max_instructions is not None and (report['instructions'] is None or
+                                                      report['instructions'] > args.max_instructions):
+                estimate = 'unbounded' if report['instructions'] is None else report['instructions']
+                print(f"Rejected: estimated {estimate} instructions, limit is {args.max_instructions}")
+                return 1
+        
+        if args.interpret:
+            return interpret(ast, args)
+        
         # Code generation
-        generator = CCodeGenerator(ast)
+        from codegen import CCodeGenerator
+        generator = CCodeGenerator(ast, io_mode=args.io, jobs=args.jobs,
+                                   profile=args.profile, sample_interval=args.profile_sample)
         c_code = generator.generate()
         
         # Write output
@@ -82,7 +180,7 @@ def main():
         # Compile and run if requested
         if args.run:
             print("\nCompiling and running the program...")
-            if not compile_and_run(args.output):
+            if not compile_and_run(args.output, args.input_file):
                 return 1
         
         return 0
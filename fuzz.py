@@ -0,0 +1,294 @@
+import argparse
+import io
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+from lexer import Lexer
+from parser import Parser
+from semantic_analyzer import SemanticAnalyzer
+from codegen import CCodeGenerator
+from interpreter import Interpreter
+from program_io import BatchIO
+from profiler import format_instruction
+from workers import make_pool
+
+# differential fuzzing: random valid programs (see grammar.bnf) go through
+# the interpreter and through CCodeGenerator + gcc, and both have to print
+# the same thing and end in the same state, or fail the same way after
+# printing the same thing. jumps go anywhere inside their own routine, so a
+# program can run away: the interpreter cuts it off at max_steps and such a
+# case is only checked for C that gcc rejects.
+
+ARITHMETIC = ['add', 'sub', 'mult', 'div', 'and', 'or']
+JUMPS = ['jmp', 'jz', 'js', 'jo']
+
+class ProgramGenerator:
+    def __init__(self, rng, size=20):
+        self.rng = rng
+        self.size = size  # about how many instructions per program
+        self.bytes = []
+        self.arrays = {}  # name -> size
+
+    def generate(self):
+        # hands back (ast, input values)
+        rng = self.rng
+        ast = []
+        for number in range(rng.randint(1, 4)):
+            self.bytes.append(f'v{number}')
+            ast.append({'type': 'declaration', 'name': f'v{number}', 'var_type': 'byte'})
+        for number in range(rng.randint(0, 2)):
+            size = rng.randint(1, 4)
+            self.arrays[f'a{number}'] = size
+            ast.append({'type': 'declaration', 'name': f'a{number}', 'var_type': f'Array[{size}]'})
+
+        routines = [f'r{number}' for number in range(rng.randint(0, 2))]
+        bodies = [(None, self.body(rng.randint(1, self.size), routines))]
+        bodies += [(name, self.body(rng.randint(1, max(1, self.size // 3)), [])) for name in routines]
+
+        # jumps are filled in once we know where every instruction ends up
+        number = 0
+        for routine, body in bodies:
+            if routine is not None:
+                ast.append({'type': 'label', 'name': routine})
+            start, end = number, number + len(body)
+            for node in body:
+                if node['command'] in JUMPS:
+                    # anywhere in the routine but itself, backwards too
+                    targets = [target for target in range(start, end) if target != number]
+                    if targets:
+                        node['operands'] = [str(rng.choice(targets))]
+                    else:
+                        node['command'], node['operands'] = 'print', [self.value()]
+                ast.append(node)
+                number += 1
+
+        inputs = [rng.randint(-128, 127) for _ in range(sum(
+            1 for node in ast if node['type'] == 'instruction' and node['command'] == 'input'))]
+        return ast, inputs
+
+    def body(self, length, routines):
+        nodes = [self.instruction(routines) for _ in range(length)]
+        if self.rng.random() < 0.5:
+            nodes.append({'type': 'instruction', 'command': self.rng.choice(['halt', 'ret']), 'operands': []})
+        return nodes
+
+    def instruction(self, routines):
+        rng = self.rng
+        command = rng.choice(['mov', 'mov'] + ARITHMETIC * 2 + ['not', 'print', 'print', 'push', 'pop',
+                                                              'input', 'isFull'] + JUMPS +
+                             (['call'] if routines else []))
+        if command == 'mov':
+            operands = [self.destination(allow_element=True), self.value()]
+        elif command in ARITHMETIC:
+            operands = [self.destination(), self.value()]
+        elif command in ['not', 'pop', 'input']:
+            operands = [self.destination()]
+        elif command in ['print', 'push']:
+            operands = [self.value()]
+        elif command == 'call':
+            operands = [rng.choice(routines)]
+        else:
+            operands = []  # isFull, and jumps get their target later
+        return {'type': 'instruction', 'command': command, 'operands': operands}
+
+    def destination(self, allow_element=False):
+        if allow_element and self.arrays and self.rng.random() < 0.3:
+            return self.element()
+        return self.rng.choice(self.bytes)
+
+    def value(self):
+        roll = self.rng.random()
+        if roll < 0.4:
+            return str(self.rng.choice([0, 1, 2, 3, 7, 64, 100, 127, self.rng.randint(0, 127)]))
+        if roll < 0.8 or not self.arrays:
+            return self.rng.choice(self.bytes)
+        return self.element()
+
+    def element(self):
+        name = self.rng.choice(sorted(self.arrays))
+        return f'{name}[{self.rng.randint(0, self.arrays[name] - 1)}]'
+
+def render(ast):
+    # ast back to source text that Lexer/Parser accept
+    declarations = [f"{node['name']}: {node['var_type']}" for node in ast if node['type'] == 'declaration']
+    lines = [f"Var {', '.join(declarations)};"]
+    for node in ast:
+        if node['type'] == 'label':
+            lines.append(f"{node['name']}:")
+        elif node['type'] == 'instruction':
+            lines.append(format_instruction(node))
+    return '\n'.join(lines)
+
+def parse(source):
+    return Parser(Lexer(source).tokens).parse()
+
+def interpreter_state(interpreter, ast):
+    # same text as the dump_state() that CCodeGenerator emits
+    lines = []
+    for node in ast:
+        if node['type'] == 'declaration':
+            value = interpreter.variables[node['name']]
+            if isinstance(value, list):
+                value = ','.join(str(item) for item in value)
+            lines.append(f"{node['name']}={value}")
+    flags = interpreter.flags
+    lines.append(f"ZF={int(flags['ZF'])} SF={int(flags['SF'])} OF={int(flags['OF'])}")
+    return '\n'.join(lines) + '\n'
+
+def run_interpreter(source, inputs, max_steps=100000):
+    # ('ok', output, state), ('error', output so far, message) or
+    # ('timeout',) when max_steps ran out
+    ast = parse(source)
+    stdout = io.StringIO()
+    interpreter = Interpreter(ast, io=BatchIO(io.StringIO(' '.join(map(str, inputs))), stdout),
+                              max_steps=max_steps)
+    try:
+        interpreter.run()
+    except RuntimeError as e:
+        if interpreter.executed >= max_steps:
+            return ('timeout',)
+        # the generated C does not say where it failed
+        return ('error', stdout.getvalue(), str(e).split(': ', 1)[-1])
+    return ('ok', stdout.getvalue(), interpreter_state(interpreter, ast))
+
+def run_compiled(source, inputs, workdir, timeout=5, execute=True):
+    # ('ok', output, state), ('error', output so far, message), ('timeout',)
+    # or ('cc-error', gcc messages) - C that gcc rejects is a codegen bug
+    # like any other disagreement. ('compiled',) when execute is off
+    c_file = os.path.join(workdir, 'case.c')
+    exe = os.path.join(workdir, 'case')
+    with open(c_file, 'w') as f:
+        f.write(CCodeGenerator(parse(source), io_mode='batch', dump_state=True).generate())
+    compiled = subprocess.run(['gcc', '-O0', '-w', c_file, '-o', exe], capture_output=True, text=True)
+    if compiled.returncode != 0:
+        return ('cc-error', compiled.stderr)
+    if not execute:
+        return ('compiled',)
+    try:
+        result = subprocess.run([exe], input=' '.join(map(str, inputs)), capture_output=True,
+                                text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return ('timeout',)
+    if result.returncode != 0:
+        # running out of input is reported on stderr (ahead of the state
+        # dump), every other runtime error as the last line of stdout
+        first = result.stderr.split('\n', 1)[0]
+        if first.startswith('No input left'):
+            return ('error', result.stdout, first)
+        output, _, message = result.stdout.rstrip('\n').rpartition('\n')
+        return ('error', output + '\n' if output else '', message)
+    return ('ok', result.stdout, result.stderr)
+
+def is_valid(ast):
+    return SemanticAnalyzer(ast).analyze()[0]
+
+def remove_instructions(ast, removed):
+    # drop instruction numbers in `removed` and renumber the jumps
+    kept = []
+    number = 0
+    for node in ast:
+        if node['type'] != 'instruction':
+            kept.append(node)
+            continue
+        if number not in removed:
+            node = dict(node)
+            if node['command'] in JUMPS:
+                target = int(node['operands'][0])
+                # a removed target now means "whatever came after it"
+                node['operands'] = [str(target - sum(1 for gone in removed if gone < target))]
+            kept.append(node)
+        number += 1
+    return kept
+
+def minimise(ast, still_fails):
+    # delta debugging: keep dropping chunks of instructions while the
+    # programs stays valid and still_fails(source) holds
+    count = sum(1 for node in ast if node['type'] == 'instruction')
+    chunk = max(1, count // 2)
+    while chunk >= 1:
+        start = 0
+        while start < count:
+            removed = set(range(start, min(start + chunk, count)))
+            candidate = remove_instructions(ast, removed)
+            if is_valid(candidate) and still_fails(render(candidate)):
+                ast = candidate
+                count -= len(removed)
+            else:
+                start += chunk
+        chunk //= 2
+    return ast
+
+def check_case(seed, size=20):
+    # run one generated program on both engines, None if they agree
+    rng = random.Random(seed)
+    ast, inputs = ProgramGenerator(rng, size).generate()
+    source = render(ast)
+    with tempfile.TemporaryDirectory() as workdir:
+        def outcomes(source):
+            interpreted = run_interpreter(source, inputs)
+            # a program the interpreter cut off would only sit out the
+            # timeout in C, so it just has to compile
+            compiled = run_compiled(source, inputs, workdir, execute=interpreted[0] != 'timeout')
+            return interpreted, compiled
+
+        def agree(interpreted, compiled):
+            return interpreted == compiled or compiled == ('compiled',)
+
+        interpreted, compiled = outcomes(source)
+        if agree(interpreted, compiled):
+            return None
+
+        def still_fails(candidate):
+            return not agree(*outcomes(candidate))
+
+        source = render(minimise(parse(source), still_fails))
+        interpreted, compiled = outcomes(source)
+    return {'seed': seed, 'source': source, 'inputs': inputs,
+            'interpreter': interpreted, 'compiled': compiled}
+
+def _check_seed(job):
+    return check_case(*job)
+
+def run_campaign(cases, seed=0, size=20, jobs=None):
+    # yields every (minimised) disagreement, cases are spread over a pool
+    jobs_list = ((seed + number, size) for number in range(cases))
+    if jobs == 1:
+        for job in jobs_list:
+            failure = _check_seed(job)
+            if failure is not None:
+                yield failure
+        return
+    with make_pool(None, jobs) as pool:
+        for failure in pool.imap_unordered(_check_seed, jobs_list, chunksize=8):
+            if failure is not None:
+                yield failure
+
+def main():
+    parser = argparse.ArgumentParser(description='Differential fuzzing: interpreter vs generated C')
+    parser.add_argument('--cases', type=int, default=1000, help='How many random programs to try')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the first case (case n uses seed + n)')
+    parser.add_argument('--size', type=int, default=20, help='About how many instructions per program')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Worker processes (default: all cores)')
+    parser.add_argument('--max-failures', type=int, default=10, help='Stop after this many disagreements')
+    args = parser.parse_args()
+
+    if not shutil.which('gcc'):
+        print("gcc not found")
+        return 1
+    failures = 0
+    for failure in run_campaign(args.cases, args.seed, args.size, args.jobs):
+        failures += 1
+        print(f"--- seed {failure['seed']} (inputs {failure['inputs']})")
+        print(failure['source'])
+        print(f"interpreter: {failure['interpreter']}")
+        print(f"compiled:    {failure['compiled']}")
+        if failures >= args.max_failures:
+            break
+    print(f"{failures} disagreement(s)")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,8 +1,15 @@
-from lexer import Lexer, Token
-from parser import Parser
+import bisect
+import hashlib
+import os
+import pickle
+import signal
+import time
+from program_io import InteractiveIO
+from semantics import DIV_ZERO, OF_BIT, SF_BIT, ZF_BIT, binary_table, to_signed, unary_table
 
 class Interpreter:
-    def __init__(self, ast, debug_mode=False):
+    def __init__(self, ast, debug_mode=False, checkpoint_path=None, checkpoint_every=0, checkpoint_fork=False,
+                 io=None, max_steps=None, max_time=None, profile=False):
         self.ast = ast
         self.data_segment = [0] * 700  # 700 bytes for data storage
         self.stack_segment = [0] * 500  # stack memory - 500 bytes should be enough
@@ -14,6 +21,27 @@ class Interpreter:
         self.current_address = 0  # next free memory slot
         self.stack_pointer = 0  # points to top of stack
         self.debug_mode = debug_mode
+        self.halted = False  # set by halt, stops the main loop
+        self.restored = False  # true when state came from a snapshot
+        self.executed = 0  # how many instructions we ran so far (declarations and labels dont count)
+        self.inputs_read = 0  # values taken from io - a resumed run skips that many
+        self.checkpoint_path = checkpoint_path  # where snapshots go (None = off)
+        self.checkpoint_every = checkpoint_every  # snapshot every N instructions (0 = only on signal)
+        self.checkpoint_fork = checkpoint_fork  # write snapshots from a forked child
+        self.checkpoint_requested = False  # set from the signal handler
+        self.checkpoint_writer = None  # pid of the child still writing a snapshot
+        self.io = io if io is not None else InteractiveIO()  # where input/print go
+        self.call_stack = []  # return positions for call/ret
+        self.call_stack_size = 256  # deeper than this is a runaway recursion
+        self.call_targets = {}  # call site -> resolved routine (filled on first use)
+        self.instruction_positions, self.labels = index_program(ast)
+        self.fingerprint = program_fingerprint(ast)  # snapshots carry this instead of the whole ast
+        self.max_steps = max_steps  # give up after this many steps (None = no limit)
+        self.max_time = max_time  # give up after this many seconds of wall time (None = no limit)
+        self.time_used = 0.0  # seconds spent inside step() - what max_time is charged for
+        self.deadline = None  # time.monotonic() value where the current slice runs out of max_time
+        self.started = False
+        self.counts = [0] * len(ast) if profile else None  # runs per ast position, for profile_counts()
 
     def debug(self, message):
         if self.debug_mode:
@@ -21,10 +49,42 @@ class Interpreter:
 
     def run(self):
         self.debug('Starting interpretation')
-        self.parse_declarations()
-        self.execute_instructions()
+        self.step()
         self.debug('All done!')
 
+    def start(self):
+        # declarations, unless a snapshot brought them along
+        if not self.restored:
+            self.parse_declarations()
+        self.started = True
+
+    def step(self, count=None):
+        # run up to `count` instructions (all of them if None) then give
+        # control back. returns True while the program has work left
+        slice_start = time.monotonic()
+        try:
+            if not self.started:
+                self.start()
+            if self.max_time is not None:
+                # only time spent in here is charged, not the turns other
+                # programs sharing the process get (scheduler.run_many)
+                if self.time_used > self.max_time:
+                    self.error(f'Time budget of {self.max_time}s exceeded')
+                self.deadline = slice_start + self.max_time - self.time_used
+            if self.execute_instructions(count):
+                return True
+        except Exception:
+            # what was printed before the error still comes out, the same
+            # as exit(1) flushing stdio in the generated C
+            self.io.flush()
+            self.wait_checkpoint_writer()
+            raise
+        finally:
+            self.time_used += time.monotonic() - slice_start
+        self.io.flush()
+        self.wait_checkpoint_writer()
+        return False
+
     def parse_declarations(self):
         # first pass - handle all the variable declarations
         for node in self.ast:
@@ -48,13 +108,35 @@ class Interpreter:
         if self.current_address >= len(self.data_segment):
             self.error('Oops - ran out of memory!')
 
-    def execute_instructions(self):
-        # run through all instructions one by one
-        while self.CO < len(self.ast):
+    def execute_instructions(self, count=None):
+        # run through all instructions one by one - True if we stopped early
+        stop = None if count is None else self.executed + count
+        if self.max_steps is not None and (stop is None or stop > self.max_steps):
+            stop = self.max_steps
+        while not self.halted and self.CO < len(self.ast):
+            if stop is not None and self.executed >= stop:
+                if self.max_steps is not None and self.executed >= self.max_steps:
+                    self.error(f'Step budget of {self.max_steps} exceeded')
+                return True
             node = self.ast[self.CO]
             if node['type'] == 'instruction':
+                if self.counts is not None:
+                    self.counts[self.CO] += 1
                 self.execute_instruction(node)
+            elif node['type'] == 'label':
+                self.ret()  # ran into the next routine - same as ret
             self.CO += 1
+            if self.CO == len(self.ast) and self.call_stack:
+                self.ret()  # last routine ran off the end of the program
+                self.CO += 1
+            if node['type'] != 'instruction':
+                continue  # only instructions are steps
+            self.executed += 1
+            if self.deadline is not None and not self.executed & 1023 and time.monotonic() > self.deadline:
+                self.error(f'Time budget of {self.max_time}s exceeded')
+            if self.checkpoint_path and (self.checkpoint_requested or
+                    (self.checkpoint_every and self.executed % self.checkpoint_every == 0)):
+                self.save_checkpoint()
 
     def execute_instruction(self, node):
         command = node['command']
@@ -97,79 +179,98 @@ class Interpreter:
             self.isFull()
         elif command == 'call':
             self.call(operands[0])
+        elif command == 'ret':
+            self.ret()
         else:
             self.error(f'Unknown command {command}')
 
     def mov(self, dest, src):
         self.debug(f'Executing mov {dest}, {src}')
-        self.variables[dest] = self.get_value(src)
+        self.set_value(dest, self.get_value(src))
 
     def add(self, dest, src):
         self.debug(f'Executing add {dest}, {src}')
-        result = self.variables[dest] + self.get_value(src)
-        self.variables[dest] = self.validate_byte_value(result, 'add')
-        self.update_flags(self.variables[dest])
+        self.binary_op('add', dest, src)
 
     def sub(self, dest, src):
         self.debug(f'Executing sub {dest}, {src}')
-        self.variables[dest] -= self.get_value(src)
-        self.update_flags(self.variables[dest])
+        self.binary_op('sub', dest, src)
 
     def mult(self, dest, src):
         self.debug(f'Executing mult {dest}, {src}')
-        self.variables[dest] *= self.get_value(src)
-        self.update_flags(self.variables[dest])
+        self.binary_op('mult', dest, src)
 
     def div(self, dest, src):
         self.debug(f'Executing div {dest}, {src}')
-        self.variables[dest] //= self.get_value(src)
-        self.update_flags(self.variables[dest])
+        self.binary_op('div', dest, src)
 
     def and_op(self, dest, src):
         self.debug(f'Executing and {dest}, {src}')
-        self.variables[dest] &= self.get_value(src)
-        self.update_flags(self.variables[dest])
+        self.binary_op('and', dest, src)
 
     def or_op(self, dest, src):
         self.debug(f'Executing or {dest}, {src}')
-        self.variables[dest] |= self.get_value(src)
-        self.update_flags(self.variables[dest])
+        self.binary_op('or', dest, src)
 
     def not_op(self, dest):
         self.debug(f'Executing not {dest}')
-        self.variables[dest] = ~self.variables[dest]
-        self.update_flags(self.variables[dest])
+        self.apply_entry(dest, unary_table('not')[self.get_value(dest) & 0xff])
+
+    def binary_op(self, command, dest, src):
+        # one lookup in the table shared with the generated C (semantics.py)
+        index = (self.get_value(dest) & 0xff) << 8 | (self.get_value(src) & 0xff)
+        self.apply_entry(dest, binary_table(command)[index])
+
+    def apply_entry(self, dest, entry):
+        if entry & DIV_ZERO:
+            self.error('Division by zero')
+        self.set_value(dest, to_signed(entry))
+        self.flags['ZF'] = 1 if entry & ZF_BIT else 0
+        self.flags['SF'] = 1 if entry & SF_BIT else 0
+        self.flags['OF'] = 1 if entry & OF_BIT else 0
 
     def jmp(self, address):
         self.debug(f'Executing jmp {address}')
-        self.CO = address - 1  # Adjust for the increment in execute_instructions
+        self.CO = self.jump_target(address) - 1  # Adjust for the increment in execute_instructions
 
     def jz(self, address):
         self.debug(f'Executing jz {address}')
         if self.flags['ZF'] == 1:
-            self.CO = address - 1  # Adjust for the increment in execute_instructions
+            self.CO = self.jump_target(address) - 1  # Adjust for the increment in execute_instructions
 
     def js(self, address):
         self.debug(f'Executing js {address}')
         if self.flags['SF'] == 1:
-            self.CO = address - 1  # Adjust for the increment in execute_instructions
+            self.CO = self.jump_target(address) - 1  # Adjust for the increment in execute_instructions
 
     def jo(self, address):
         self.debug(f'Executing jo {address}')
         if self.flags['OF'] == 1:
-            self.CO = address - 1  # Adjust for the increment in execute_instructions
+            self.CO = self.jump_target(address) - 1  # Adjust for the increment in execute_instructions
+
+    def jump_target(self, address):
+        # jumps count instructions only (like the C labels), not declarations
+        number = int(address)
+        if number < 0 or number >= len(self.instruction_positions):
+            self.error(f'Invalid jump target {address}')
+        return self.instruction_positions[number]
 
     def input_op(self, dest):
         self.debug(f'Executing input {dest}')
-        self.variables[dest] = int(input(f'Input value for {dest}: '))
+        value = self.io.read(dest)
+        if value is None:
+            self.error(f'No input left for {dest}')
+        self.inputs_read += 1
+        self.variables[dest] = value
 
     def print_op(self, src):
         self.debug(f'Executing print {src}')
-        print(self.get_value(src))
+        self.io.write(self.get_value(src))
 
     def halt(self):
         self.debug('Executing halt')
-        exit()
+        self.halted = True
+        self.io.flush()
 
     def push(self, src):
         self.debug(f'Executing push {src}')
@@ -190,11 +291,37 @@ class Interpreter:
 
     def isFull(self):
         self.debug('Executing isFull')
-        print(self.stack_pointer >= len(self.stack_segment))
+        self.io.write(self.stack_pointer >= len(self.stack_segment))
 
     def call(self, function_name):
         self.debug(f'Executing call {function_name}')
-        # Implementation of call depends on the function definitions
+        target = self.call_targets.get(self.CO)
+        if target is None:
+            if function_name not in self.labels:
+                self.error(f'Unknown routine {function_name}')
+            target = self.call_targets[self.CO] = self.labels[function_name]
+        if len(self.call_stack) >= self.call_stack_size:
+            self.error('Call stack overflow')
+        self.call_stack.append(self.CO)
+        self.CO = target  # the label itself - next step runs its first instruction
+
+    def ret(self):
+        self.debug('Executing ret')
+        if not self.call_stack:
+            self.halt()  # returning from the main program ends it
+            return
+        self.CO = self.call_stack.pop()  # back to the call, next step goes past it
+
+    def set_value(self, dest, value):
+        # plain variable or array element, like get_value
+        if '[' in dest and ']' in dest:
+            var_name, index = dest.split('[')
+            index = int(index[:-1])
+            if index < 0 or index >= len(self.variables[var_name]):
+                self.error(f'Array index {index} out of bounds for {var_name}')
+            self.variables[var_name][index] = value
+        else:
+            self.variables[dest] = value
 
     def get_value(self, operand):
         if isinstance(operand, int) or operand.isdigit():
@@ -210,21 +337,128 @@ class Interpreter:
         else:
             self.error(f'Unknown operand {operand}')
 
-    def update_flags(self, result):
-        self.flags['ZF'] = 1 if result == 0 else 0
-        self.flags['SF'] = 1 if result < 0 else 0
-        self.flags['OF'] = 1 if result < -127 or result > 128 else 0
+    def profile_counts(self):
+        # how often each instruction ran, by instruction number (see profiler.py)
+        return [self.counts[position] for position in self.instruction_positions]
+
+    def snapshot(self):
+        # grab the whole machine state - plain buffer copies so its cheap
+        return {
+            'program': self.fingerprint,
+            'CO': self.CO,
+            'executed': self.executed,
+            'inputs_read': self.inputs_read,
+            'halted': self.halted,
+            'flags': dict(self.flags),
+            'registers': dict(self.registers),
+            'data_segment': list(self.data_segment),
+            'stack_segment': list(self.stack_segment),
+            'stack_pointer': self.stack_pointer,
+            'variables': {name: list(value) if isinstance(value, list) else value
+                          for name, value in self.variables.items()},
+            'variable_addresses': dict(self.variable_addresses),
+            'current_address': self.current_address,
+            'call_stack': list(self.call_stack),
+        }
+
+    def restore(self, state):
+        # put a snapshot back - refuse to mix it with some other program
+        if state['program'] != self.fingerprint:
+            self.error('Snapshot was taken from a different program')
+        self.CO = state['CO']
+        self.executed = state['executed']
+        self.inputs_read = state['inputs_read']
+        self.halted = state['halted']
+        self.flags = dict(state['flags'])
+        self.registers = dict(state['registers'])
+        self.data_segment = list(state['data_segment'])
+        self.stack_segment = list(state['stack_segment'])
+        self.stack_pointer = state['stack_pointer']
+        self.variables = {name: list(value) if isinstance(value, list) else value
+                          for name, value in state['variables'].items()}
+        self.variable_addresses = dict(state['variable_addresses'])
+        self.current_address = state['current_address']
+        self.call_stack = list(state['call_stack'])
+        self.restored = True
+        self.debug(f'Restored snapshot at instruction {self.instruction_number()}')
+
+    def save_checkpoint(self, path=None):
+        path = path or self.checkpoint_path
+        self.checkpoint_requested = False
+        self.io.flush()  # output up to here belongs to this snapshot
+        self.debug(f'Writing checkpoint to {path}')
+        if self.checkpoint_fork and hasattr(os, 'fork'):
+            # child gets a copy-on-write view of the state, parent keeps running
+            self.wait_checkpoint_writer()
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    write_snapshot(path, self.snapshot())
+                finally:
+                    os._exit(0)
+            self.checkpoint_writer = pid
+        else:
+            write_snapshot(path, self.snapshot())
+
+    def wait_checkpoint_writer(self):
+        # dont leave a half written snapshot (or a zombie) behind
+        if self.checkpoint_writer is not None:
+            os.waitpid(self.checkpoint_writer, 0)
+            self.checkpoint_writer = None
+
+    def load_checkpoint(self, path=None):
+        with open(path or self.checkpoint_path, 'rb') as f:
+            self.restore(pickle.load(f))
+        # the input stream starts over, so step past what was already read
+        self.io.skip(self.inputs_read)
+
+    def checkpoint_on_signal(self, signum=None):
+        # ask for a snapshot at the next instruction boundary (SIGUSR1 by default)
+        def handler(signum, frame):
+            self.checkpoint_requested = True
+        signal.signal(signum or signal.SIGUSR1, handler)
+
+    def instruction_number(self):
+        # CO is an ast position, people (and jumps, labels, profiles) count instructions
+        return instruction_number(self.instruction_positions, self.CO)
 
     def error(self, message):
-        raise RuntimeError(f'Error at instruction {self.CO}: {message}')
+        raise RuntimeError(f'Error at instruction {self.instruction_number()}: {message}')
 
-    def validate_byte_value(self, value, operation):
-        if value < -128 or value > 127:
-            self.error(f'Result of {operation} ({value}) out of range for byte')
-        return value
+def index_program(ast):
+    # precomputed symbol index: where each instruction number and each
+    # routine label sit in the ast
+    instruction_positions = []
+    labels = {}
+    for position, node in enumerate(ast):
+        if node['type'] == 'instruction':
+            instruction_positions.append(position)
+        elif node['type'] == 'label':
+            labels[node['name']] = position
+    return instruction_positions, labels
+
+def instruction_number(instruction_positions, position):
+    # number of the instruction at `position` - anywhere else (a label, the
+    # end) counts as the next instruction
+    return bisect.bisect_left(instruction_positions, position)
+
+def program_fingerprint(ast):
+    # short stand-in for the program, so a snapshot costs the same however
+    # big the program is
+    return hashlib.sha256(repr(ast).encode()).hexdigest()
+
+def write_snapshot(path, state):
+    # write to a temp file first so a crash never leaves a broken snapshot
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
 
 # Example usage
 if __name__ == '__main__':
+    from lexer import Lexer
+    from parser import Parser
+
     code = '''
     Var x: byte, y: Array[10];
     mov x, 5;
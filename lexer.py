@@ -2,7 +2,7 @@ import re
 
 # regex patterns for different token types - kinda messy but works ok
 TOKEN_TYPES = {
-    'KEYWORD': r'\b(Var|Instructions|byte|Array|mov|add|sub|mult|div|and|or|not|jmp|jz|js|jo|input|print|halt|push|pop|isFull|call)\b',
+    'KEYWORD': r'\b(Var|Instructions|byte|Array|mov|add|sub|mult|div|and|or|not|jmp|jz|js|jo|input|print|halt|push|pop|isFull|call|ret)\b',
     'IDENTIFIER': r'\b[a-zA-Z][a-zA-Z0-9_]*\b',
     'NUMBER': r'\b[+-]?[0-9]+\b',
     'OPERATOR': r'[+\-*/]',
@@ -10,6 +10,23 @@ TOKEN_TYPES = {
     'WHITESPACE': r'\s+',  # spaces tabs etc
 }
 
+# all the patterns glued into one regex, built the first time we need it.
+# alternatives are tried left to right, same order as TOKEN_TYPES.
+# a leading \b used to sit at the start of the leftover code, so it becomes
+# (?=\w) - otherwise the char before pos would count now
+_token_regex = None
+
+def token_regex():
+    global _token_regex
+    if _token_regex is None:
+        patterns = []
+        for token_type, pattern in TOKEN_TYPES.items():
+            if pattern.startswith(r'\b'):
+                pattern = r'(?=\w)' + pattern[2:]
+            patterns.append(f'(?P<{token_type}>{pattern})')
+        _token_regex = re.compile('|'.join(patterns))
+    return _token_regex
+
 # stores info about each token we find
 class Token:
     def __init__(self, type, value):
@@ -29,23 +46,17 @@ class Lexer:
 
     def tokenize(self):
         code = self.code
-        while code:  # keep going till we process everything
-            match = None
-            # try each pattern until something matches
-            for token_type, pattern in TOKEN_TYPES.items():
-                regex = re.compile(pattern)
-                match = regex.match(code)
-                if match:
-                    value = match.group(0)
-                    # dont care about whitespace - skip it
-                    if token_type != 'WHITESPACE':
-                        self.tokens.append(Token(token_type, value))
-                    code = code[len(value):]  # move forward in the code
-                    break
-            
+        regex = token_regex()
+        pos = 0
+        while pos < len(code):  # keep going till we process everything
+            match = regex.match(code, pos)
             # uh oh - found something we dont understand
             if not match:
-                raise SyntaxError(f'Weird character found: {code[0]}')
+                raise SyntaxError(f'Weird character found: {code[pos]}')
+            # dont care about whitespace - skip it
+            if match.lastgroup != 'WHITESPACE':
+                self.tokens.append(Token(match.lastgroup, match.group()))
+            pos = match.end()  # move forward in the code
         
         # add special token to mark the end
         self.tokens.append(Token('EOF', 'EOF'))
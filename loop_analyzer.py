@@ -0,0 +1,273 @@
+from semantics import wrap_byte
+
+FLAG_SETTERS = ['add', 'sub', 'mult', 'div', 'and', 'or', 'not']
+WRITERS = FLAG_SETTERS + ['mov', 'input', 'pop']
+JUMP_FLAGS = {'jmp': None, 'jz': 'ZF', 'js': 'SF', 'jo': 'OF'}
+INFINITE = float('inf')  # trip count of a loop that can never exit
+
+# static cost estimate for a program: finds the loops made by backward
+# jumps, works out how often simple counting loops run and adds up how many
+# instructions, stack slots and I/O operations the program will need.
+# forward jumps are assumed not taken, so the numbers are upper bounds;
+# None means "cant tell" (unbounded).
+class LoopAnalyzer:
+    def __init__(self, ast, max_trips=256):
+        self.ast = ast
+        self.max_trips = max_trips  # a byte counter repeats after 256 steps
+        self.instructions = [node for node in ast if node['type'] == 'instruction']
+        self.jumps = [(number, int(node['operands'][0])) for number, node in enumerate(self.instructions)
+                      if node['command'] in JUMP_FLAGS]  # (source, target) of every jump
+        self.jump_targets = {target for _, target in self.jumps}
+        self.routine_of = []  # instruction number -> routine (None = main)
+        self.routine_ranges = {None: [0, 0]}  # routine -> [first, end) instruction numbers
+        self.loops = []  # every loop found, outermost first
+        self.top_loops = {}  # routine -> loops not inside another loop
+        self.irregular = False  # loops overlapping without nesting
+        self.routine_costs = {}
+        self.in_progress = set()  # routines being costed - catches recursion
+
+    def analyze(self):
+        self.find_routines()
+        self.find_loops()
+        main_start, main_end = self.routine_ranges[None]
+        cost = self.range_cost(main_start, main_end, self.top_loops[None])
+        return {
+            'loops': [{'start': loop['start'], 'end': loop['end'], 'trips': loop['trips']}
+                      for loop in self.loops],
+            'instructions': cost['instructions'],
+            'stack_depth': cost['peak'],
+            'inputs': cost['inputs'],
+            'outputs': cost['outputs'],
+            'runaway': any(loop['trips'] == INFINITE for loop in self.loops),
+        }
+
+    def find_routines(self):
+        routine = None
+        for node in self.ast:
+            if node['type'] == 'label':
+                self.routine_ranges[routine][1] = len(self.routine_of)
+                routine = node['name']
+                self.routine_ranges[routine] = [len(self.routine_of), len(self.routine_of)]
+            elif node['type'] == 'instruction':
+                self.routine_of.append(routine)
+        self.routine_ranges[routine][1] = len(self.routine_of)
+
+    def find_loops(self):
+        # a backward jump closes a loop; several jumps back to the same
+        # place make one loop that ends at the last of them
+        back_edges = {}
+        for number, node in enumerate(self.instructions):
+            if node['command'] in JUMP_FLAGS:
+                target = int(node['operands'][0])
+                if 0 <= target <= number and self.routine_of[target] == self.routine_of[number]:
+                    back_edges.setdefault(target, []).append(number)
+        for start in sorted(back_edges):
+            sources = back_edges[start]
+            end = max(sources)
+            trips = self.trip_count(start, end) if len(sources) == 1 else None
+            self.loops.append({'start': start, 'end': end, 'trips': trips, 'children': []})
+        self.loops.sort(key=lambda loop: (loop['start'], -loop['end']))
+
+        # nest them - inner loops hang off the loop around them
+        self.top_loops = {routine: [] for routine in self.routine_ranges}
+        open_loops = []
+        for loop in self.loops:
+            while open_loops and open_loops[-1]['end'] < loop['start']:
+                open_loops.pop()
+            if open_loops and loop['end'] > open_loops[-1]['end']:
+                self.irregular = True  # overlaps without nesting
+                continue
+            if open_loops:
+                open_loops[-1]['children'].append(loop)
+            else:
+                self.top_loops[self.routine_of[loop['start']]].append(loop)
+            open_loops.append(loop)
+
+    def trip_count(self, start, end):
+        node = self.instructions[end]
+        if node['command'] != 'jmp':
+            # conditional jump back - the loop goes round again while the flag is set
+            return self.count_iterations(start, end, end, JUMP_FLAGS[node['command']], exit_when=False)
+        # unconditional jump back - someone inside has to jump out
+        exits = []
+        for number in range(start, end):
+            inner = self.instructions[number]
+            if inner['command'] in ['halt', 'ret']:
+                return None
+            if inner['command'] in JUMP_FLAGS and inner['command'] != 'jmp':
+                target = int(inner['operands'][0])
+                if target < start or target > end:
+                    exits.append(number)
+        if not exits:
+            return INFINITE
+        if len(exits) > 1:
+            return None
+        exit_jump = self.instructions[exits[0]]
+        return self.count_iterations(start, end, exits[0], JUMP_FLAGS[exit_jump['command']], exit_when=True)
+
+    def count_iterations(self, start, end, jump, flag, exit_when):
+        # the loop ends when `flag` (as set by the last arithmetic before
+        # `jump`) becomes exit_when. only simple counters are understood:
+        # "add/sub v, constant" with v set by a mov before the loop
+        if flag not in ['ZF', 'SF']:
+            return None
+        # a jump from outside into the loop could skip the mov that sets
+        # the counter up, then the counter starts from anything
+        for number, target in self.jumps:
+            if not start <= number <= end and start <= target <= end:
+                return None
+        setter = None
+        for number in range(jump - 1, start - 1, -1):
+            if self.instructions[number]['command'] in FLAG_SETTERS:
+                setter = number
+                break
+        if setter is None:
+            return None
+        command = self.instructions[setter]['command']
+        operands = self.instructions[setter]['operands']
+        if command not in ['add', 'sub'] or not is_constant(operands[1]):
+            return None
+        # a jump inside the loop that skips the update or the test could
+        # keep the loop going - "not taken" is no upper bound there
+        for number in range(start, end):
+            node = self.instructions[number]
+            if node['command'] in JUMP_FLAGS:
+                target = int(node['operands'][0])
+                if number < setter < target <= end or number < jump < target <= end:
+                    return None
+        counter = operands[0]
+        for number in range(start, end + 1):
+            if number != setter and self.writes(self.instructions[number], counter):
+                return None
+        value = self.initial_value(counter, start)
+        if value is None:
+            return None
+        step = int(operands[1]) if command == 'add' else -int(operands[1])
+        for trips in range(1, self.max_trips + 1):
+            value = wrap_byte(value + step)
+            flag_set = value == 0 if flag == 'ZF' else value < 0
+            if flag_set == exit_when:
+                return trips
+        return INFINITE
+
+    def writes(self, node, variable):
+        if node['command'] == 'call':
+            return True  # could do anything to it
+        return node['command'] in WRITERS and node['operands'] and node['operands'][0] == variable
+
+    def initial_value(self, variable, start):
+        # value of `variable` every time the loop is entered - only "mov v,
+        # constant" on the straight line leading into it. the scan stops at
+        # jump targets, which includes the start of any loop around this
+        # one: a mov outside that loop would only run once, not per pass
+        first = self.routine_ranges[self.routine_of[start]][0]
+        for number in range(start - 1, first - 1, -1):
+            node = self.instructions[number]
+            if node['command'] in JUMP_FLAGS or self.writes(node, variable):
+                if node['command'] == 'mov' and node['operands'][0] == variable and is_constant(node['operands'][1]):
+                    return int(node['operands'][1])
+                return None
+            if number in self.jump_targets:
+                return None
+        # main starts with everything at zero, routines dont know
+        return 0 if self.routine_of[start] is None else None
+
+    def range_cost(self, start, end, loops):
+        # cost of running instructions [start, end) once
+        cost = {'instructions': 0, 'peak': 0, 'net': 0, 'inputs': 0, 'outputs': 0}
+        loops = {loop['start']: loop for loop in loops}
+        number = start
+        while number < end:
+            if number in loops:
+                loop = loops[number]
+                body = self.range_cost(loop['start'], loop['end'] + 1, loop['children'])
+                item = repeat_cost(body, loop['trips'])
+                number = loop['end'] + 1
+            else:
+                item = self.instruction_cost(self.instructions[number])
+                number += 1
+            cost = sequence_cost(cost, item)
+        if self.irregular:
+            cost['instructions'] = None
+        return cost
+
+    def instruction_cost(self, node):
+        command = node['command']
+        cost = {'instructions': 1, 'peak': 0, 'net': 0, 'inputs': 0, 'outputs': 0}
+        if command == 'push':
+            cost['peak'] = cost['net'] = 1
+        elif command == 'pop':
+            cost['net'] = -1
+        elif command == 'input':
+            cost['inputs'] = 1
+        elif command in ['print', 'isFull']:
+            cost['outputs'] = 1
+        elif command == 'call':
+            cost = sequence_cost(cost, self.routine_cost(node['operands'][0]))
+        return cost
+
+    def routine_cost(self, name):
+        if name in self.routine_costs:
+            return self.routine_costs[name]
+        if name in self.in_progress or name not in self.routine_ranges:
+            # recursion (or a bad name) - no idea how deep it goes
+            return {'instructions': None, 'peak': None, 'net': None, 'inputs': None, 'outputs': None}
+        self.in_progress.add(name)
+        start, end = self.routine_ranges[name]
+        cost = self.range_cost(start, end, self.top_loops[name])
+        self.in_progress.discard(name)
+        self.routine_costs[name] = cost
+        return cost
+
+def sequence_cost(first, second):
+    # run `first` then `second`
+    cost = {}
+    for key in ['instructions', 'inputs', 'outputs', 'net']:
+        cost[key] = add_or_none(first[key], second[key])
+    if first['peak'] is None or first['net'] is None or second['peak'] is None:
+        cost['peak'] = None
+    else:
+        cost['peak'] = max(first['peak'], first['net'] + second['peak'])
+    return cost
+
+def repeat_cost(body, trips):
+    # run `body` trips times (None/INFINITE = no bound)
+    if trips is None or trips == INFINITE:
+        return {
+            'instructions': None,
+            'inputs': None if body['inputs'] != 0 else 0,
+            'outputs': None if body['outputs'] != 0 else 0,
+            'net': None if body['net'] != 0 else 0,
+            'peak': None if body['net'] != 0 else body['peak'],
+        }
+    cost = {key: multiply_or_none(body[key], trips)
+            for key in ['instructions', 'inputs', 'outputs', 'net']}
+    if body['peak'] is None or body['net'] is None:
+        cost['peak'] = None
+    else:
+        cost['peak'] = body['peak'] + max(body['net'], 0) * (trips - 1)
+    return cost
+
+def add_or_none(a, b):
+    return None if a is None or b is None else a + b
+
+def multiply_or_none(a, n):
+    return None if a is None else a * n
+
+def is_constant(operand):
+    return str(operand).lstrip('+-').isdigit()
+
+def format_report(report):
+    def show(value):
+        return 'unbounded' if value is None else str(value)
+    lines = ['Cost estimate:']
+    for loop in report['loops']:
+        trips = loop['trips']
+        trips = 'never exits' if trips == INFINITE else ('unknown' if trips is None else f'{trips} trips')
+        lines.append(f"  loop {loop['start']}-{loop['end']}: {trips}")
+    lines.append(f"  instructions executed: {show(report['instructions'])}")
+    lines.append(f"  max stack depth: {show(report['stack_depth'])}")
+    lines.append(f"  inputs: {show(report['inputs'])}, outputs: {show(report['outputs'])}")
+    if report['runaway']:
+        lines.append('  warning: program has a loop that never exits')
+    return '\n'.join(lines)
@@ -69,8 +69,19 @@ class Parser:
 
     def liste_instructions(self):
         self.debug('Parsing liste_instructions')
-        while self.current_token.type == 'KEYWORD':
-            self.instruction()
+        while self.current_token.type in ('KEYWORD', 'IDENTIFIER'):
+            if self.current_token.type == 'IDENTIFIER':
+                self.etiquette()
+            else:
+                self.instruction()
+
+    def etiquette(self):
+        # "name:" starts a routine that call can jump into
+        self.debug('Parsing etiquette')
+        label = self.current_token.value
+        self.match('IDENTIFIER')
+        self.match('PUNCTUATION', ':')
+        self.ast.append({'type': 'label', 'name': label})
 
     def instruction(self):
         self.debug('Parsing instruction')
@@ -98,7 +109,7 @@ class Parser:
                 self.match('PUNCTUATION', '(')
                 self.operands.append(self.operande())
                 self.match('PUNCTUATION', ')')
-            elif command == 'halt':
+            elif command in ['halt', 'ret']:
                 pass
             elif command in ['push', 'pop']:
                 self.operands.append(self.operande())
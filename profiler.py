@@ -0,0 +1,58 @@
+BLOCK_ENDS = ['jmp', 'jz', 'js', 'jo', 'call', 'halt', 'ret']
+
+# execution profile report, written by the interpreter (--interpret
+# --profile) and by C binaries built with CCodeGenerator(profile=...).
+# one line per instruction that ran, in program order, so hot loops show
+# up as runs of big counts:
+#
+#   Profile: 1204 instructions executed
+#      instr      count  source
+#          2        300  add x, 2;
+#
+# binaries that sample add a samples column (SIGPROF ticks, per basic
+# block, on the first instruction of the block).
+
+def format_instruction(node):
+    # instruction back to the source text the parser reads
+    command, operands = node['command'], node['operands']
+    if command in ['input', 'print']:
+        return f"{command}({operands[0]});"
+    if operands:
+        return f"{command} {', '.join(operands)};"
+    return f"{command};"
+
+def find_blocks(ast):
+    # leader instruction numbers of the basic blocks, in order: the start
+    # of main and of every routine, every jump target, and whatever comes
+    # after a jump, call, halt or ret
+    targets = {int(node['operands'][0]) for node in ast
+               if node['type'] == 'instruction' and node['command'] in ['jmp', 'jz', 'js', 'jo']}
+    leaders = []
+    starts_block = True
+    number = 0
+    for node in ast:
+        if node['type'] == 'label':
+            starts_block = True
+        elif node['type'] == 'instruction':
+            if starts_block or number in targets:
+                leaders.append(number)
+            starts_block = node['command'] in BLOCK_ENDS
+            number += 1
+    return leaders
+
+def format_profile(ast, counts, samples=None):
+    # counts (and samples) are indexed by instruction number
+    instructions = [node for node in ast if node['type'] == 'instruction']
+    header = f"Profile: {sum(counts)} instructions executed"
+    if samples is None:
+        lines = [header, f"{'instr':>8} {'count':>10}  source"]
+    else:
+        lines = [f"{header}, {sum(samples)} samples", f"{'instr':>8} {'count':>10} {'samples':>10}  source"]
+    for number, node in enumerate(instructions):
+        if not counts[number]:
+            continue
+        if samples is None:
+            lines.append(f"{number:>8} {counts[number]:>10}  {format_instruction(node)}")
+        else:
+            lines.append(f"{number:>8} {counts[number]:>10} {samples[number]:>10}  {format_instruction(node)}")
+    return '\n'.join(lines) + '\n'
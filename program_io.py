@@ -0,0 +1,97 @@
+import sys
+
+# the three ways a program can talk to the outside world. the interpreter
+# only ever calls read/write/flush (and skip, when resuming), and CCodeGenerator emits the matching
+# read_input/write_output helpers, so both back ends behave the same.
+IO_MODES = ('interactive', 'batch', 'binary')
+
+def to_byte(value):
+    # wrap like scanf("%hhd") does
+    return (int(value) + 128) % 256 - 128
+
+class InteractiveIO:
+    # prompt for every input, print every value right away
+    def read(self, name):
+        return to_byte(input(f'Input value for {name}: '))
+
+    def write(self, value):
+        print(int(value))
+
+    def flush(self):
+        pass
+
+    def skip(self, count):
+        pass  # whoever types the input carries on where they left off
+
+class BatchIO:
+    # whitespace separated numbers from a stream, no prompts.
+    # output is kept in a buffer and written out in big blocks
+    def __init__(self, stdin=None, stdout=None, buffer_size=65536):
+        self.stdin = stdin if stdin is not None else sys.stdin
+        self.stdout = stdout if stdout is not None else sys.stdout
+        self.buffer_size = buffer_size
+        self.pending = []  # values not written yet
+        self.tokens = []  # numbers read but not used yet (reversed)
+
+    def read(self, name):
+        while not self.tokens:
+            line = self.stdin.readline()
+            if not line:
+                return None
+            self.tokens = line.split()[::-1]
+        return to_byte(self.tokens.pop())
+
+    def skip(self, count):
+        # drop values a checkpointed run already consumed
+        for _ in range(count):
+            if self.read(None) is None:
+                break
+
+    def write(self, value):
+        self.pending.append(str(int(value)))
+        if len(self.pending) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.pending.append('')
+            self.stdout.write('\n'.join(self.pending))
+            self.pending = []
+        self.stdout.flush()
+
+class BinaryIO:
+    # raw signed bytes both ways - one byte per value, nothing else
+    def __init__(self, stdin=None, stdout=None, buffer_size=65536):
+        self.stdin = stdin if stdin is not None else sys.stdin.buffer
+        self.stdout = stdout if stdout is not None else sys.stdout.buffer
+        self.buffer_size = buffer_size
+        self.pending = bytearray()
+
+    def read(self, name):
+        data = self.stdin.read(1)
+        if not data:
+            return None
+        return to_byte(data[0])
+
+    def skip(self, count):
+        self.stdin.read(count)
+
+    def write(self, value):
+        self.pending.append(int(value) & 0xff)
+        if len(self.pending) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.stdout.write(bytes(self.pending))
+            self.pending = bytearray()
+        self.stdout.flush()
+
+def make_io(mode, stdin=None, stdout=None):
+    if mode == 'interactive':
+        return InteractiveIO()
+    if mode == 'batch':
+        return BatchIO(stdin, stdout)
+    if mode == 'binary':
+        return BinaryIO(stdin, stdout)
+    raise ValueError(f'Unknown I/O mode {mode}')
@@ -0,0 +1,19 @@
+import asyncio
+
+# cooperative time slicing: lots of interpreters share one event loop,
+# each runs a slice of instructions and then lets the next one go.
+# give them batch/binary I/O - an interactive input() would block everybody
+
+async def drive(interpreter, slice_size=1000):
+    while interpreter.step(slice_size):
+        await asyncio.sleep(0)  # back to the event loop, next program's turn
+    return interpreter
+
+async def run_all(interpreters, slice_size=1000):
+    # one result per program, in order: the finished interpreter, or the
+    # error that stopped it (a blown budget doesnt take the others down)
+    return await asyncio.gather(*(drive(interpreter, slice_size) for interpreter in interpreters),
+                                return_exceptions=True)
+
+def run_many(interpreters, slice_size=1000):
+    return asyncio.run(run_all(interpreters, slice_size))
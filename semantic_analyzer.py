@@ -1,11 +1,19 @@
+from workers import make_pool, shared, split_chunks
+
 class SemanticAnalyzer:
-    def __init__(self, ast):
+    def __init__(self, ast, jobs=1, chunk_size=20000):
         self.ast = ast
+        self.jobs = jobs              # worker processes for big programs (None = all cores)
+        self.chunk_size = chunk_size  # instructions per worker task
         self.variables = {}  # keeps track of declared vars
         self.errors = []     # collect any errors we find
+        self.routines = set()  # names of the labelled routines
+        self.routine_of = []   # instruction number -> routine it belongs to (None = main)
+        self.current_instruction = 0
         
     def analyze(self):
         self.check_declarations()
+        self.check_routines()
         self.check_instructions()
         return len(self.errors) == 0, self.errors
     
@@ -18,11 +26,43 @@ class SemanticAnalyzer:
                     self.errors.append(f"Variable {var_name} already declared")
                 self.variables[var_name] = node['var_type']
     
+    def check_routines(self):
+        # each label starts a routine that runs until the next label
+        routine = None
+        for node in self.ast:
+            if node['type'] == 'label':
+                routine = node['name']
+                if routine in self.routines:
+                    self.errors.append(f"Routine {routine} already defined")
+                elif routine in self.variables:
+                    self.errors.append(f"Routine {routine} clashes with a variable")
+                self.routines.add(routine)
+            elif node['type'] == 'instruction':
+                self.routine_of.append(routine)
+    
     def check_instructions(self):
         # make sure all instructions are valid
-        for node in self.ast:
+        chunks = split_chunks(self.ast, self.chunk_size)
+        if self.jobs == 1 or len(chunks) == 1:
+            self.errors.extend(self.check_range(0, len(self.ast), 0))
+            return
+        # every instruction is checked on its own against the (read only)
+        # declarations, so chunks can go to workers and come back in order
+        with make_pool(self, self.jobs) as pool:
+            for errors in pool.imap(_check_chunk, chunks):
+                self.errors.extend(errors)
+    
+    def check_range(self, start, end, first_instruction):
+        # check ast[start:end] and hand back only the errors found there
+        errors = self.errors
+        self.errors = []
+        self.current_instruction = first_instruction
+        for node in self.ast[start:end]:
             if node['type'] == 'instruction':
                 self.check_instruction(node)
+                self.current_instruction += 1
+        found, self.errors = self.errors, errors
+        return found
     
     def check_instruction(self, node):
         command = node['command']
@@ -43,6 +83,8 @@ class SemanticAnalyzer:
             self.check_input(operands)
         elif command in ['push', 'pop']:
             self.check_stack_operation(command, operands)
+        elif command == 'call':
+            self.check_call(operands)
     
     def check_arithmetic_operation(self, op, operands):
         if len(operands) != 2:
@@ -111,11 +153,22 @@ class SemanticAnalyzer:
         
         try:
             label = int(operands[0])
-            if label < 0:
+            if label < 0 or label >= len(self.routine_of):
                 self.errors.append(f"Invalid jump label {label}")
+            elif self.routine_of[label] != self.routine_of[self.current_instruction]:
+                # C lowers routines to functions - goto cant leave one
+                self.errors.append(f"Jump to {label} leaves its routine")
         except ValueError:
             self.errors.append(f"Jump label must be a number, got {operands[0]}")
     
+    def check_call(self, operands):
+        if len(operands) != 1:
+            self.errors.append("Call requires exactly 1 operand")
+            return
+        
+        if operands[0] not in self.routines:
+            self.errors.append(f"Routine undefined {operands[0]}")
+    
     def check_print(self, operands):
         if len(operands) != 1:
             self.errors.append("Print requires exactly 1 operand")
@@ -140,4 +193,8 @@ class SemanticAnalyzer:
             if operands[0] not in self.variables:
                 self.errors.append(f"Variable undefined {operands[0]}")
         else:  # push
-            self.check_operand(operands[0]) 
\ No newline at end of file
+            self.check_operand(operands[0]) 
+
+def _check_chunk(chunk):
+    start, end, first_instruction, routine = chunk
+    return shared().check_range(start, end, first_instruction)
@@ -0,0 +1,150 @@
+import operator
+import sys
+from array import array
+
+# byte-exact arithmetic, shared by the interpreter, the lockstep engine and
+# the generated C. every binary opcode has a 256x256 table indexed by
+# (dest & 0xff) << 8 | (src & 0xff); every entry packs the wrapped result
+# with the flags it sets, so doing the arithmetic is a single lookup.
+# the generated C fills the same tables at startup from C_OPERATIONS and
+# a C copy of make_entry (see CCodeGenerator.arithmetic_helpers).
+RESULT_MASK = 0x0ff  # low byte: the result as an unsigned byte
+ZF_BIT = 0x100
+SF_BIT = 0x200
+OF_BIT = 0x400  # true result did not fit in a signed byte
+DIV_ZERO = 0x800  # no result - division by zero
+
+def wrap_byte(value):
+    # two's complement wrap to -128..127
+    return (value + 128) % 256 - 128
+
+def to_signed(entry):
+    return ((entry & RESULT_MASK) ^ 0x80) - 0x80
+
+def divide(a, b):
+    # C division: rounds toward zero
+    quotient = abs(a) // abs(b)
+    return -quotient if (a < 0) != (b < 0) else quotient
+
+BINARY_OPS = {
+    'add': operator.add,
+    'sub': operator.sub,
+    'mult': operator.mul,
+    'div': divide,
+    'and': operator.and_,
+    'or': operator.or_,
+}
+
+UNARY_OPS = {
+    'not': operator.invert,
+}
+
+# the exact result of every opcode in C, on ints a and b. C division
+# truncates like divide()
+C_OPERATIONS = {
+    'add': 'a + b',
+    'sub': 'a - b',
+    'mult': 'a * b',
+    'div': 'a / b',
+    'and': 'a & b',
+    'or': 'a | b',
+    'not': '~a',
+}
+
+def make_entry(exact):
+    result = wrap_byte(exact)
+    return ((result & RESULT_MASK) |
+            (ZF_BIT if result == 0 else 0) |
+            (SF_BIT if result < 0 else 0) |
+            (OF_BIT if result != exact else 0))
+
+_binary_tables = {}
+_unary_tables = {}
+_SIGNED = [value - 256 if value > 127 else value for value in range(256)]  # byte value of every index
+
+# the tables are cut out of one base table instead of running make_entry
+# 65536 times per opcode: _EXACT[_ZERO + exact] is make_entry(exact) for
+# every exact result an opcode can give. only the middle 256 fit a byte,
+# everything else repeats the byte entries with OF set
+_ZERO = 32768
+_EXACT = array('H', [make_entry(value) | OF_BIT for value in range(256)]) * 256
+_EXACT[_ZERO - 128:_ZERO + 128] = array('H', [make_entry(value) for value in range(-128, 128)])
+
+# a row is every b (in index order: 0..127, then -128..-1) for one a. the
+# exact results along a row are evenly spaced, so each half is one slice
+def _add_row(a):
+    return _EXACT[_ZERO + a:_ZERO + a + 128] + _EXACT[_ZERO + a - 128:_ZERO + a]
+
+def _sub_row(a):
+    return _EXACT[_ZERO + a:_ZERO + a - 128:-1] + _EXACT[_ZERO + a + 128:_ZERO + a:-1]
+
+def _mult_row(a):
+    if a == 0:
+        return _EXACT[_ZERO:_ZERO + 1] * 256
+    return _EXACT[_ZERO:_ZERO + 128 * a:a] + _EXACT[_ZERO - 128 * a:_ZERO:a]
+
+def _by_rows(row):
+    table = array('H')
+    for a in _SIGNED:
+        table += row(a)
+    return table
+
+def _quotient_runs(divisor, sign):
+    # entries of sign * (m // divisor) for m = 0..128: every quotient
+    # divisor times in a row
+    column = array('H')
+    for entry in _EXACT[_ZERO:_ZERO + sign * (128 // divisor + 1):sign]:
+        column += array('H', [entry]) * divisor
+    return column[:129]
+
+def _div_table():
+    # filled a column (one b) at a time; m // |b| for a = m or -m
+    table = array('H', [DIV_ZERO]) * 65536  # stays in the b == 0 column
+    for divisor in range(1, 129):
+        up, down = _quotient_runs(divisor, 1), _quotient_runs(divisor, -1)
+        # a = 0..127, then -128..-1
+        table[divisor & 0xff::256] = up[:128] + down[128:0:-1]
+        table[-divisor & 0xff::256] = down[:128] + up[128:0:-1]
+    return table
+
+def _bitwise_table(operation):
+    # and/or never overflow, so the entry only depends on the result byte.
+    # each row is worked out in one go on all 256 bytes packed into an
+    # int, and the flags are added by translate()
+    lanes = int.from_bytes(bytes(range(256)), 'big')
+    results = b''.join(operation(int.from_bytes(bytes([a]) * 256, 'big'), lanes).to_bytes(256, 'big')
+                       for a in range(256))
+    flags = bytes(make_entry(value) >> 8 for value in _SIGNED)
+    entries = bytearray(2 * len(results))
+    entries[0::2] = results
+    entries[1::2] = results.translate(flags)
+    table = array('H')
+    table.frombytes(entries)
+    if sys.byteorder == 'big':
+        table.byteswap()  # entries was written little-endian
+    return table
+
+_TABLE_BUILDERS = {
+    'add': lambda: _by_rows(_add_row),
+    'sub': lambda: _by_rows(_sub_row),
+    'mult': lambda: _by_rows(_mult_row),
+    'div': _div_table,
+    'and': lambda: _bitwise_table(operator.and_),
+    'or': lambda: _bitwise_table(operator.or_),
+}
+
+def binary_table(command):
+    # built the first time a program uses the opcode, then kept. gives the
+    # same entries as make_entry(BINARY_OPS[command](a, b)) for every a, b
+    table = _binary_tables.get(command)
+    if table is None:
+        table = _binary_tables[command] = _TABLE_BUILDERS[command]()
+    return table
+
+def unary_table(command):
+    table = _unary_tables.get(command)
+    if table is None:
+        operation = UNARY_OPS[command]
+        table = array('H', (make_entry(operation(value)) for value in _SIGNED))
+        _unary_tables[command] = table
+    return table
@@ -1,8 +1,40 @@
+import io
+import os
+import shutil
+import subprocess
+import tempfile
 import unittest
+import importlib.util
 from lexer import Lexer
 from parser import Parser
 from semantic_analyzer import SemanticAnalyzer
 from codegen import CCodeGenerator
+from interpreter import Interpreter
+from batch import run_batch
+from program_io import BatchIO, BinaryIO
+from loop_analyzer import LoopAnalyzer, INFINITE
+from scheduler import run_many
+from profiler import format_profile
+import fuzz
+
+def parse(source):
+    return Parser(Lexer(source).tokens).parse()
+
+def interpret(source, stdin=''):
+    stdout = io.StringIO()
+    Interpreter(parse(source), io=BatchIO(io.StringIO(stdin), stdout)).run()
+    return stdout.getvalue()
+
+def run_c(source, stdin='', **options):
+    c_code = CCodeGenerator(parse(source), io_mode='batch', **options).generate()
+    with tempfile.TemporaryDirectory() as tmp:
+        c_file = os.path.join(tmp, 'prog.c')
+        with open(c_file, 'w') as f:
+            f.write(c_code)
+        subprocess.run(['gcc', c_file, '-o', os.path.join(tmp, 'prog')], check=True)
+        result = subprocess.run([os.path.join(tmp, 'prog')], input=stdin,
+                                capture_output=True, text=True)
+    return result.stdout
 
 class TestCompiler(unittest.TestCase):
     def test_simple_program(self):
@@ -33,5 +65,455 @@ class TestCompiler(unittest.TestCase):
         c_code = generator.generate()
         self.assertIn('int main', c_code)
 
+    def test_checkpoint_resume(self):
+        source = """
+        Var x: byte, y: Array[3];
+        mov x, 5;
+        add x, 3;
+        push x;
+        pop x;
+        halt;
+        """
+        ast = Parser(Lexer(source).tokens).parse()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'state.ckpt')
+            interpreter = Interpreter(ast, checkpoint_path=path, checkpoint_every=3)
+            interpreter.run()
+            self.assertTrue(interpreter.halted)
+
+            # snapshot was taken right after "push x" (3 instructions, 5 ast nodes in)
+            resumed = Interpreter(ast)
+            resumed.load_checkpoint(path)
+            self.assertEqual(resumed.CO, 5)
+            self.assertEqual(resumed.variables['x'], 8)
+            resumed.run()
+            self.assertEqual(resumed.snapshot(), interpreter.snapshot())
+            with self.assertRaisesRegex(RuntimeError, 'different program'):
+                Interpreter(parse('Var x: byte; halt;')).load_checkpoint(path)
+
+            # input read before the snapshot is not read again after resuming
+            ast = parse('Var a: byte, b: byte, n: byte; input(a); mov n, 50; sub n, 1; jz 5; jmp 2;'
+                        'input(b); print(a); print(b); halt;')
+            interpreter = Interpreter(ast, io=BatchIO(io.StringIO('11 22'), io.StringIO()))
+            while interpreter.ast[interpreter.CO].get('operands') != ['b']:
+                interpreter.step(1)  # up to input(b), after the loop
+            interpreter.save_checkpoint(path)
+            stdout = io.StringIO()
+            resumed = Interpreter(ast, io=BatchIO(io.StringIO('11 22'), stdout))
+            resumed.load_checkpoint(path)
+            resumed.run()
+            self.assertEqual(stdout.getvalue(), '11\n22\n')
+
+    def test_batch_run(self):
+        source = """
+        Var x: byte, y: byte;
+        input(x);
+        input(y);
+        add x, y;
+        print(x);
+        halt;
+        """
+        ast = Parser(Lexer(source).tokens).parse()
+        vectors = [[i, 2 * i] for i in range(40)]
+        expected = [[str(3 * i)] for i in range(40)]
+        self.assertEqual(list(run_batch(ast, vectors, processes=1)), expected)
+        self.assertEqual(list(run_batch(ast, vectors, processes=2)), expected)
+
+        # a failing or looping vector does not take the others down
+        ast = parse('Var x: byte, y: byte; input(x); input(y); print(x); div x, y; print(x); jz 7; halt; jmp 7;')
+        for processes in (1, 2):
+            results = list(run_batch(ast, [[4, 2], [5, 0], [9, 3], [2, 3]], processes=processes, max_steps=1000))
+            self.assertEqual([results[0], results[2]], [['4', '2'], ['9', '3']])
+            self.assertRegex(str(results[1]), 'Division by zero')
+            self.assertEqual(results[1].output, ['5'])
+            self.assertRegex(str(results[3]), 'Step budget of 1000 exceeded')
+
+    @unittest.skipUnless(importlib.util.find_spec('numpy'), 'numpy not installed')
+    def test_lockstep_matches_scalar(self):
+        from vector_interpreter import run_lockstep
+        source = """
+        Var x: byte, n: byte;
+        input(n);
+        mov x, 0;
+        add x, 2;
+        sub n, 1;
+        jz 6;
+        jmp 2;
+        print(x);
+        halt;
+        """
+        ast = Parser(Lexer(source).tokens).parse()
+        # every lane loops a different number of times
+        vectors = [[n] for n in range(1, 30)]
+        self.assertEqual(run_lockstep(ast, vectors), list(run_batch(ast, vectors, processes=1)))
+
+        # a failing lane only stops itself, short vectors are not padded
+        # with zeros, and no vectors means no runs
+        def outcomes(results):
+            return [(str(result), result.output) if isinstance(result, Exception) else result
+                    for result in results]
+        ast = parse('Var x: byte, y: byte; input(x); print(x); input(y); div x, y; print(x); push x; pop x; pop x;')
+        vectors = [[4, 2], [5, 0], [9], [9, 3]]
+        results = outcomes(run_lockstep(ast, vectors))
+        self.assertEqual(results, outcomes(run_batch(ast, vectors, processes=1)))
+        self.assertEqual([result[0] for result in results],
+                         [f'Error at instruction {number}: {message}' for number, message in
+                          [(7, 'Stack underflow'), (3, 'Division by zero'), (2, 'No input left for y'),
+                           (7, 'Stack underflow')]])
+        self.assertEqual(run_lockstep(ast, []), [])
+
+    IO_SOURCE = """
+    Var x: byte, y: byte;
+    input(x);
+    input(y);
+    add x, y;
+    print(x);
+    print(y);
+    isFull;
+    halt;
+    """
+
+    def test_binary_io(self):
+        ast = Parser(Lexer(self.IO_SOURCE).tokens).parse()
+        stdout = io.BytesIO()
+        Interpreter(ast, io=BinaryIO(io.BytesIO(bytes([3, 0xfe])), stdout)).run()
+        self.assertEqual(stdout.getvalue(), bytes([1, 0xfe, 0]))
+
+    @unittest.skipUnless(shutil.which('gcc'), 'gcc not installed')
+    def test_batch_io_matches_c(self):
+        output = interpret(self.IO_SOURCE, '20\n 7')
+        self.assertEqual(output, '27\n7\n0\n')
+        self.assertEqual(run_c(self.IO_SOURCE, '20\n 7'), output)
+
+    CALL_SOURCE = """
+    Var x: byte, n: byte;
+    mov x, 1;
+    mov n, 3;
+    call double;
+    sub n, 1;
+    jz 6;
+    jmp 2;
+    print(x);
+    halt;
+    double:
+    add x, x;
+    print(x);
+    ret;
+    """
+
+    def test_call_and_ret(self):
+        self.assertEqual(interpret(self.CALL_SOURCE), '2\n4\n8\n8\n')
+        success, errors = SemanticAnalyzer(parse(self.CALL_SOURCE)).analyze()
+        self.assertTrue(success, errors)
+
+        with self.assertRaisesRegex(RuntimeError, 'Call stack overflow'):
+            interpret('Var x: byte; call forever; forever: call forever;')
+
+        success, errors = SemanticAnalyzer(parse('Var x: byte; call f; jmp 3; halt; f: ret;')).analyze()
+        self.assertEqual(errors, ['Jump to 3 leaves its routine'])
+
+    def test_output_before_error(self):
+        # buffered output is not lost when the program fails, C flushes it on exit(1) too
+        source = 'Var x: byte; mov x, 7; print(x); pop x;'
+        stdout = io.StringIO()
+        with self.assertRaisesRegex(RuntimeError, 'Error at instruction 2: Stack underflow'):
+            Interpreter(parse(source), io=BatchIO(io.StringIO(), stdout)).run()
+        self.assertEqual(stdout.getvalue(), '7\n')
+        if shutil.which('gcc'):
+            self.assertEqual(run_c(source), '7\nStack underflow\n')
+
+    @unittest.skipUnless(shutil.which('gcc'), 'gcc not installed')
+    def test_call_matches_c(self):
+        self.assertEqual(run_c(self.CALL_SOURCE), interpret(self.CALL_SOURCE))
+
+    @unittest.skipUnless(shutil.which('gcc'), 'gcc not installed')
+    def test_runtime_names_as_variables(self):
+        # names the generated C uses for itself are fine as variable names
+        source = """
+        Var stack: byte, stack_pointer: byte, ZF: Array[2], call_depth: byte, read_input: byte, exit: byte;
+        mov stack, 1;
+        input(stack_pointer);
+        add stack, stack_pointer;
+        mov ZF[1], stack;
+        print(ZF[1]);
+        halt;
+        """
+        self.assertEqual(interpret(source, '4'), '5\n')
+        self.assertEqual(run_c(source, '4'), '5\n')
+
+    def test_parallel_chunks_match_serial(self):
+        source = 'Var x: byte, y: Array[4];\n' + 'mov x, 1;\nadd x, y[1];\njz 0;\n' * 30
+        source += 'mov z, 1;\nf:\nprint(y[9]);\njmp 3;\nret;\ng:\nsub x, 1;\njs 92;\nret;\n'
+
+        serial = SemanticAnalyzer(parse(source))
+        serial.analyze()
+        parallel = SemanticAnalyzer(parse(source), jobs=2, chunk_size=7)
+        parallel.analyze()
+        self.assertEqual(len(serial.errors), 4)
+        self.assertEqual(parallel.errors, serial.errors)
+
+        c_code = CCodeGenerator(parse(source)).generate()
+        for chunk_size in (1, 7, 91, 93):
+            self.assertEqual(CCodeGenerator(parse(source), jobs=2, chunk_size=chunk_size).generate(), c_code)
+
+    def test_loop_cost_estimate(self):
+        source = """
+        Var i: byte, j: byte, s: byte;
+        mov i, 3;
+        mov j, 4;
+        add s, 1;
+        print(s);
+        sub j, 1;
+        jz 7;
+        jmp 2;
+        push s;
+        sub i, 1;
+        js 11;
+        jmp 1;
+        call f;
+        halt;
+        f:
+        input(s);
+        ret;
+        """
+        report = LoopAnalyzer(parse(source)).analyze()
+        self.assertEqual([(loop['start'], loop['end'], loop['trips']) for loop in report['loops']],
+                         [(1, 10, 4), (2, 6, 4)])
+        self.assertEqual(report['instructions'], 1 + 4 * (1 + 4 * 5 + 4) + 3 + 1)
+        self.assertEqual(report['stack_depth'], 4)
+        self.assertEqual((report['inputs'], report['outputs']), (1, 16))
+        self.assertFalse(report['runaway'])
+
+        # j is only set before the outer loop, so after the first pass the
+        # inner loop has to count all the way round
+        source = 'Var i: byte, j: byte; mov i,3; mov j,4; print(j); sub j,1; jz 6; jmp 3; sub i,1; jz 9; jmp 2; halt;'
+        interpreter = Interpreter(parse(source), io=BatchIO(io.StringIO(), io.StringIO()), profile=True)
+        interpreter.run()
+        report = LoopAnalyzer(parse(source)).analyze()
+        self.assertEqual([(loop['start'], loop['end'], loop['trips']) for loop in report['loops']],
+                         [(2, 8, 3), (3, 5, None)])
+        self.assertIsNone(report['instructions'])
+        self.assertGreater(sum(interpreter.profile_counts()), 1000)
+
+        # so does a jump into the loop that skips the counter's mov
+        source = 'Var i: byte, z: byte; mov i, 100; sub z, 0; jz 4; mov i, 3; sub i, 1; jz 7; jmp 4; halt;'
+        report = LoopAnalyzer(parse(source)).analyze()
+        self.assertEqual(report['loops'][0]['trips'], None)
+        self.assertIsNone(report['instructions'])
+
+        # a jump over the counter update means the trip count is unknown
+        report = LoopAnalyzer(parse('Var x: byte; mov x, 3; jo 3; sub x, 1; jz 5; jmp 1; halt;')).analyze()
+        self.assertEqual(report['loops'][0]['trips'], None)
+
+        # 1, 3, 5, ... never hits zero
+        report = LoopAnalyzer(parse('Var x: byte; mov x, 1; add x, 2; jz 4; jmp 1; halt;')).analyze()
+        self.assertEqual(report['loops'][0]['trips'], INFINITE)
+        self.assertIsNone(report['instructions'])
+        self.assertTrue(report['runaway'])
+
+    def test_budgets_and_time_slicing(self):
+        forever = parse('Var x: byte; mov x, 1; jmp 0;')
+        with self.assertRaisesRegex(RuntimeError, 'Step budget of 5000 exceeded'):
+            Interpreter(forever, max_steps=5000).run()
+        with self.assertRaisesRegex(RuntimeError, 'Time budget'):
+            Interpreter(forever, max_time=0.05).run()
+
+        counting = parse('Var n: byte; mov n, 50; sub n, 1; jz 4; jmp 1; print(n); halt;')
+        interpreter = Interpreter(counting, io=BatchIO(io.StringIO(), io.StringIO()))
+        self.assertTrue(interpreter.step(10))
+        self.assertEqual(interpreter.executed, 10)
+        while interpreter.step(10):
+            pass
+        self.assertTrue(interpreter.halted)
+        self.assertEqual(interpreter.io.stdout.getvalue(), '0\n')
+
+        # declarations are not steps
+        interpreter = Interpreter(parse('Var a: byte, b: byte, c: byte; halt;'))
+        interpreter.run()
+        self.assertEqual(interpreter.executed, 1)
+
+        # time spent outside step() (other programs' turns) is not charged
+        import time
+        interpreter = Interpreter(counting, io=BatchIO(io.StringIO(), io.StringIO()), max_time=0.1)
+        interpreter.step(10)
+        time.sleep(0.15)
+        while interpreter.step(10):
+            pass
+        self.assertTrue(interpreter.halted)
+        self.assertLess(interpreter.time_used, 0.1)
+
+        outputs = [io.StringIO() for _ in range(3)]
+        interpreters = [Interpreter(counting, io=BatchIO(io.StringIO(), outputs[0])),
+                        Interpreter(forever, max_steps=1000),
+                        Interpreter(counting, io=BatchIO(io.StringIO(), outputs[2]))]
+        results = run_many(interpreters, slice_size=7)
+        self.assertIs(results[0], interpreters[0])
+        self.assertIsInstance(results[1], RuntimeError)
+        self.assertEqual([outputs[0].getvalue(), outputs[2].getvalue()], ['0\n', '0\n'])
+
+    def test_fuzz_generator_and_minimiser(self):
+        import random
+        backward = 0
+        for seed in range(50):
+            ast, inputs = fuzz.ProgramGenerator(random.Random(seed)).generate()
+            source = fuzz.render(ast)
+            # round trips through the front end
+            self.assertEqual(parse(source), ast)
+            self.assertTrue(fuzz.is_valid(ast), source)
+            outcome = fuzz.run_interpreter(source, inputs, max_steps=10000)
+            self.assertIn(outcome[0], ['ok', 'error', 'timeout'])
+            instructions = [node for node in ast if node['type'] == 'instruction']
+            backward += any(node['command'] in fuzz.JUMPS and int(node['operands'][0]) < number
+                            for number, node in enumerate(instructions))
+        self.assertTrue(backward)
+
+        source = 'Var x: byte, y: byte;\nmov x, 3;\njz 4;\nprint(x);\nmov y, 1;\nadd y, x;\nprint(y);\nhalt;'
+        minimised = fuzz.minimise(parse(source), lambda candidate: 'add y, x;' in candidate)
+        self.assertEqual(fuzz.render(minimised), 'Var x: byte, y: byte;\nadd y, x;')
+
+        # removing the jump target retargets the jump at what came after it
+        self.assertEqual(fuzz.remove_instructions(parse(source), {2, 3})[3]['operands'], ['2'])
+
+    @unittest.skipUnless(shutil.which('gcc'), 'gcc not installed')
+    def test_fuzz_differential(self):
+        from unittest import mock
+        self.assertIsNone(fuzz.check_case(0))
+
+        # failures compare what was printed before them and the message
+        with tempfile.TemporaryDirectory() as workdir:
+            for source, inputs, message in [
+                ('Var x: byte; print(1); pop x;', [], 'Stack underflow'),
+                ('Var x: byte; print(2); div x, 0;', [], 'Division by zero'),
+                ('Var x: byte; input(x); print(x); input(x);', [5], 'No input left for x'),
+            ]:
+                interpreted = fuzz.run_interpreter(source, inputs)
+                self.assertEqual(interpreted[0], 'error')
+                self.assertEqual(interpreted[2], message)
+                self.assertEqual(interpreted, fuzz.run_compiled(source, inputs, workdir))
+            self.assertEqual(fuzz.run_interpreter('Var x: byte; jmp 0;', [])[0], 'timeout')
+
+        # C that gcc rejects is reported (and minimised), not raised
+        with mock.patch.object(fuzz.CCodeGenerator, 'generate', return_value='not C'):
+            failure = fuzz.check_case(0)
+        self.assertEqual(failure['seed'], 0)
+        self.assertEqual(failure['interpreter'][0], 'ok')
+        self.assertEqual(failure['compiled'][0], 'cc-error')
+        self.assertTrue(fuzz.is_valid(parse(failure['source'])))
+
+    def test_mov_into_array_element(self):
+        self.assertEqual(interpret('Var a: Array[3]; mov a[1], 7; print(a[1]); print(a[0]);'), '7\n0\n')
+
+    # prints the result, then 1 if OF was set
+    ARITHMETIC_SOURCE = """
+    Var a: byte, b: byte, f: byte;
+    input(a);
+    input(b);
+    {} a, b;
+    jo 5;
+    jmp 6;
+    mov f, 1;
+    print(a);
+    print(f);
+    halt;
+    """
+
+    ARITHMETIC_CASES = [
+        ('add', 100, 100, '-56\n1\n'),
+        ('sub', -128, 1, '127\n1\n'),
+        ('mult', 16, 16, '0\n1\n'),
+        ('mult', -3, 5, '-15\n0\n'),
+        ('div', -7, 2, '-3\n0\n'),
+        ('div', -128, -1, '-128\n1\n'),
+        ('and', -1, 5, '5\n0\n'),
+        ('or', -128, 1, '-127\n0\n'),
+    ]
+
+    def test_byte_arithmetic(self):
+        for command, a, b, expected in self.ARITHMETIC_CASES:
+            self.assertEqual(interpret(self.ARITHMETIC_SOURCE.format(command), f'{a} {b}'), expected)
+        with self.assertRaisesRegex(RuntimeError, 'Division by zero'):
+            interpret(self.ARITHMETIC_SOURCE.format('div'), '5 0')
+        self.assertEqual(interpret('Var x: byte; not x; print(x);'), '-1\n')
+
+    @unittest.skipUnless(importlib.util.find_spec('numpy'), 'numpy not installed')
+    def test_byte_arithmetic_lockstep(self):
+        # the lockstep engine uses the same tables
+        from vector_interpreter import run_lockstep
+        vectors = [[a, b] for a in range(-128, 128, 17) for b in range(-127, 128, 23)]
+        for command in ['add', 'sub', 'mult', 'div']:
+            ast = parse(self.ARITHMETIC_SOURCE.format(command))
+            self.assertEqual(run_lockstep(ast, vectors), list(run_batch(ast, vectors, processes=1)))
+
+    @unittest.skipUnless(shutil.which('gcc'), 'gcc not installed')
+    def test_byte_arithmetic_matches_c(self):
+        for command, a, b, expected in self.ARITHMETIC_CASES:
+            self.assertEqual(run_c(self.ARITHMETIC_SOURCE.format(command), f'{a} {b}'), expected)
+
+    def test_tables_match_make_entry(self):
+        # the sliced tables against the plain definition, entry by entry
+        from semantics import BINARY_OPS, DIV_ZERO, binary_table, make_entry
+        for command, operation in BINARY_OPS.items():
+            table = binary_table(command)
+            for a in range(-128, 128):
+                for b in range(-128, 128):
+                    expected = DIV_ZERO if command == 'div' and b == 0 else make_entry(operation(a, b))
+                    self.assertEqual(table[(a & 0xff) << 8 | (b & 0xff)], expected, (command, a, b))
+
+    @unittest.skipUnless(shutil.which('gcc'), 'gcc not installed')
+    def test_c_tables_match_semantics(self):
+        # init_tables() in the generated C has to rebuild semantics.py exactly
+        from semantics import BINARY_OPS, UNARY_OPS, binary_table, unary_table
+        source = 'Var x: byte;\n' + ''.join(f'{command} x, x;\n' for command in BINARY_OPS) + 'not x;'
+        tables = {command: binary_table(command) for command in BINARY_OPS}
+        tables.update({command: unary_table(command) for command in UNARY_OPS})
+        c_code = '\n'.join([
+            '#include <stdio.h>', '#include <stdlib.h>', '#include <stdint.h>', 'int8_t ZF, SF, OF;',
+            *CCodeGenerator(parse(source)).arithmetic_helpers(),
+            'int main(void) {',
+            '    init_tables();',
+            *[f'    for (int i = 0; i < {len(table)}; i++) printf("%d\\n", {command}_table[i]);'
+              for command, table in tables.items()],
+            '    return 0;',
+            '}',
+        ])
+        with tempfile.TemporaryDirectory() as tmp:
+            c_file = os.path.join(tmp, 'tables.c')
+            with open(c_file, 'w') as f:
+                f.write(c_code)
+            subprocess.run(['gcc', c_file, '-o', os.path.join(tmp, 'tables')], check=True)
+            result = subprocess.run([os.path.join(tmp, 'tables')], capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.split(), [str(entry) for table in tables.values() for entry in table])
+
+    def test_profile_matches_c(self):
+        ast = parse(self.CALL_SOURCE)
+        interpreter = Interpreter(ast, io=BatchIO(io.StringIO(), io.StringIO()), profile=True)
+        interpreter.run()
+        counts = interpreter.profile_counts()
+        self.assertEqual(counts, [1, 1, 3, 3, 3, 2, 1, 1, 3, 3, 3])
+        report = format_profile(ast, counts)
+        self.assertIn('       2          3  call double;', report)
+        if not shutil.which('gcc'):
+            return
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'profile.txt')
+            run_c(self.CALL_SOURCE, profile=path)
+            with open(path) as f:
+                self.assertEqual(f.read(), report)
+            # sampling adds a column, the counts stay the same
+            run_c(self.CALL_SOURCE, profile=path, sample_interval=1000)
+            with open(path) as f:
+                lines = f.read().splitlines()
+
+            # both variants build without warnings
+            for options in [{}, {'sample_interval': 1000}]:
+                c_file = os.path.join(tmp, 'prog.c')
+                with open(c_file, 'w') as f:
+                    f.write(CCodeGenerator(ast, io_mode='batch', profile=path, **options).generate())
+                subprocess.run(['gcc', '-Wall', '-Werror', '-c', c_file, '-o', os.path.join(tmp, 'prog.o')],
+                               check=True)
+        self.assertTrue(lines[0].startswith(f'Profile: {sum(counts)} instructions executed, '))
+        self.assertEqual(lines[4].split()[:2] + lines[4].split()[3:], ['2', '3', 'call', 'double;'])
+
 if __name__ == '__main__':
     unittest.main() 
\ No newline at end of file
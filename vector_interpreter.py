@@ -0,0 +1,305 @@
+import numpy as np
+from interpreter import index_program, instruction_number
+from semantics import BINARY_OPS, DIV_ZERO, OF_BIT, RESULT_MASK, SF_BIT, ZF_BIT, binary_table, unary_table
+
+# runs one program over many input sets at once: every byte variable is an
+# int8 column with one entry per lane, every array a (lanes, size) block.
+# lanes that branch differently are scheduled "lowest CO first", so they
+# meet up again as soon as their paths join.
+class VectorInterpreter:
+    def __init__(self, ast, inputs=None, lanes=None, debug_mode=False, input_lengths=None):
+        self.ast = ast
+        if inputs is not None:
+            inputs = np.asarray(inputs, dtype=np.int16)
+            if inputs.ndim == 1:
+                inputs = inputs.reshape(-1, 1)
+            if lanes is None:
+                lanes = inputs.shape[0]
+        self.lanes = 1 if lanes is None else lanes  # zero lanes is fine, run() does nothing
+        self.inputs = inputs  # (lanes, n) values consumed by input, in order
+        # how many of each lane's inputs are real - the rest is padding
+        if input_lengths is None:
+            input_lengths = np.full(self.lanes, 0 if inputs is None else inputs.shape[1])
+        self.input_lengths = np.asarray(input_lengths, dtype=np.int64)
+        self.input_pos = np.zeros(self.lanes, dtype=np.int64)  # next input per lane
+        self.stack_segment = np.zeros((self.lanes, 500), dtype=np.int8)  # same 500 bytes as the scalar one
+        self.stack_pointer = np.zeros(self.lanes, dtype=np.int64)
+        self.flags = {name: np.zeros(self.lanes, dtype=bool) for name in ('ZF', 'SF', 'OF')}
+        self.CO = np.zeros(self.lanes, dtype=np.int64)  # one instruction pointer per lane
+        self.running = np.ones(self.lanes, dtype=bool)  # cleared by halt or a lane error
+        self.errors = {}  # lane -> message of the error that stopped it
+        self.call_stack = np.zeros((self.lanes, 256), dtype=np.int64)  # return positions per lane
+        self.call_depth = np.zeros(self.lanes, dtype=np.int64)
+        self.instruction_positions, self.labels = index_program(ast)
+        self.variables = {}
+        self.outputs = []  # (lane mask, values) for every print that ran
+        self.debug_mode = debug_mode
+
+    def debug(self, message):
+        if self.debug_mode:
+            print(f'DEBUG: {message}')
+
+    def run(self):
+        self.debug(f'Starting lockstep interpretation over {self.lanes} lanes')
+        self.parse_declarations()
+        self.execute_instructions()
+        self.debug('All done!')
+
+    def parse_declarations(self):
+        for node in self.ast:
+            if node['type'] == 'declaration':
+                self.declare_variable(node)
+
+    def declare_variable(self, node):
+        var_name = node['name']
+        var_type = node['var_type']
+        if var_type == 'byte':
+            self.variables[var_name] = np.zeros(self.lanes, dtype=np.int8)
+        elif var_type.startswith('Array'):
+            size = int(var_type.split('[')[1].split(']')[0])
+            self.variables[var_name] = np.zeros((self.lanes, size), dtype=np.int8)
+        self.debug(f'Setup var {var_name} ({var_type})')
+
+    def execute_instructions(self):
+        end = len(self.ast)
+        while True:
+            # lanes whose routine ran off the end of the program go back to the caller
+            finished = self.running & (self.CO >= end) & (self.call_depth > 0)
+            if finished.any():
+                self.ret(finished)
+            live = self.running & (self.CO < end)
+            if not live.any():
+                break
+            # lowest CO goes first, lanes behind catch up with the others
+            self.current = int(self.CO[live].min())
+            mask = live & (self.CO == self.current)
+            self.full = bool(mask.all())
+            self.CO[mask] = self.current + 1
+            node = self.ast[self.current]
+            if node['type'] == 'instruction':
+                self.execute_instruction(node, mask)
+            elif node['type'] == 'label':
+                self.ret(mask)  # ran into the next routine - same as ret
+
+    def execute_instruction(self, node, mask):
+        command = node['command']
+        operands = node['operands']
+        if command == 'mov':
+            self.store(operands[0], self.get_value(operands[1]), mask)
+        elif command in BINARY_OPS:
+            self.arithmetic(command, operands[0], operands[1], mask)
+        elif command == 'not':
+            self.apply_entries(operands[0], lane_table('not')[as_index(self.get_value(operands[0]))], mask)
+        elif command == 'jmp':
+            self.jump(operands[0], mask)
+        elif command in ('jz', 'js', 'jo'):
+            flag = {'jz': 'ZF', 'js': 'SF', 'jo': 'OF'}[command]
+            self.jump(operands[0], mask & self.flags[flag])
+        elif command == 'input':
+            self.input_op(operands[0], mask)
+        elif command == 'print':
+            self.emit(self.get_value(operands[0]), mask)
+        elif command == 'halt':
+            self.running[mask] = False
+        elif command == 'push':
+            self.push(operands[0], mask)
+        elif command == 'pop':
+            self.pop(operands[0], mask)
+        elif command == 'isFull':
+            self.emit((self.stack_pointer >= self.stack_segment.shape[1]).astype(np.int8), mask)
+        elif command == 'call':
+            self.call(operands[0], mask)
+        elif command == 'ret':
+            self.ret(mask)
+        else:
+            self.error(f'Unknown command {command}')
+
+    def arithmetic(self, command, dest, src, mask):
+        # same lookup tables as the scalar interpreter and the generated C
+        a = as_index(self.get_value(dest))
+        b = as_index(np.broadcast_to(self.get_value(src), (self.lanes,)))
+        self.apply_entries(dest, lane_table(command)[a << 8 | b], mask)
+
+    def apply_entries(self, dest, entries, mask):
+        # store the byte results and set ZF/SF/OF for the lanes that ran it
+        mask = self.fail_lanes(mask, mask & ((entries & DIV_ZERO) != 0), 'Division by zero')
+        self.store(dest, (entries & RESULT_MASK).astype(np.uint8).view(np.int8), mask)
+        self.set_flag('ZF', (entries & ZF_BIT) != 0, mask)
+        self.set_flag('SF', (entries & SF_BIT) != 0, mask)
+        self.set_flag('OF', (entries & OF_BIT) != 0, mask)
+
+    def set_flag(self, name, values, mask):
+        if self.full:
+            self.flags[name] = values
+        else:
+            self.flags[name][mask] = values[mask]
+
+    def jump(self, address, mask):
+        self.debug(f'Jump to {address} on {int(mask.sum())} lanes')
+        number = int(address)
+        if number < 0 or number >= len(self.instruction_positions):
+            self.error(f'Invalid jump target {address}')
+        self.CO[mask] = self.instruction_positions[number]
+
+    def call(self, function_name, mask):
+        if function_name not in self.labels:
+            self.error(f'Unknown routine {function_name}')
+        mask = self.fail_lanes(mask, mask & (self.call_depth >= self.call_stack.shape[1]), 'Call stack overflow')
+        lanes = np.flatnonzero(mask)
+        depth = self.call_depth[lanes]
+        self.call_stack[lanes, depth] = self.current
+        self.call_depth[lanes] += 1
+        self.CO[lanes] = self.labels[function_name] + 1
+
+    def ret(self, mask):
+        # lanes with nothing to return to are in main - that ends them
+        self.running[mask & (self.call_depth == 0)] = False
+        lanes = np.flatnonzero(mask & (self.call_depth > 0))
+        self.call_depth[lanes] -= 1
+        self.CO[lanes] = self.call_stack[lanes, self.call_depth[lanes]] + 1
+
+    def input_op(self, dest, mask):
+        if self.inputs is None:
+            self.error(f'No input given for {dest}')
+        mask = self.fail_lanes(mask, mask & (self.input_pos >= self.input_lengths), f'No input left for {dest}')
+        pos = self.input_pos[mask]
+        values = np.zeros(self.lanes, dtype=np.int16)
+        values[mask] = self.inputs[mask, pos]
+        self.store(dest, values.astype(np.int8), mask)
+        self.input_pos[mask] += 1
+
+    def emit(self, values, mask):
+        values = np.broadcast_to(values, (self.lanes,))
+        self.outputs.append((mask.copy(), values[mask].copy()))
+
+    def push(self, src, mask):
+        mask = self.fail_lanes(mask, mask & (self.stack_pointer >= self.stack_segment.shape[1]), 'Stack overflow')
+        lanes = np.flatnonzero(mask)
+        sp = self.stack_pointer[lanes]
+        values = np.broadcast_to(self.get_value(src), (self.lanes,))
+        self.stack_segment[lanes, sp] = values[lanes]
+        self.stack_pointer[lanes] += 1
+
+    def pop(self, dest, mask):
+        mask = self.fail_lanes(mask, mask & (self.stack_pointer == 0), 'Stack underflow')
+        lanes = np.flatnonzero(mask)
+        self.stack_pointer[lanes] -= 1
+        values = np.zeros(self.lanes, dtype=np.int8)
+        values[lanes] = self.stack_segment[lanes, self.stack_pointer[lanes]]
+        self.store(dest, values, mask)
+
+    def get_value(self, operand):
+        # constants stay numpy scalars and broadcast, variables are columns
+        if isinstance(operand, int) or operand.lstrip('+-').isdigit():
+            return np.int16(int(operand))
+        if '[' in operand and ']' in operand:
+            var_name, index = self.split_element(operand)
+            return self.variables[var_name][:, index]
+        if operand in self.variables:
+            return self.variables[operand]
+        self.error(f'Unknown operand {operand}')
+
+    def store(self, dest, values, mask):
+        values = np.broadcast_to(values, (self.lanes,)).astype(np.int8)
+        if '[' in dest and ']' in dest:
+            var_name, index = self.split_element(dest)
+            column = self.variables[var_name][:, index]
+        elif dest in self.variables:
+            column = self.variables[dest]
+        else:
+            self.error(f'Unknown operand {dest}')
+        if self.full:
+            column[:] = values
+        else:
+            column[mask] = values[mask]
+
+    def split_element(self, operand):
+        var_name, index = operand.split('[')
+        index = int(index[:-1])
+        if var_name not in self.variables or self.variables[var_name].ndim != 2:
+            self.error(f'{var_name} is not an array')
+        if index < 0 or index >= self.variables[var_name].shape[1]:
+            self.error(f'Array index {index} out of bounds for {var_name}')
+        return var_name, index
+
+    def all_outputs(self):
+        # everything each lane printed, in order, in a single pass over the prints
+        result = [[] for _ in range(self.lanes)]
+        for mask, printed in self.outputs:
+            for lane, value in zip(np.flatnonzero(mask).tolist(), printed.tolist()):
+                result[lane].append(value)
+        return result
+
+    def fail_lanes(self, mask, failed, message):
+        # errors that depend on a lane's data stop only that lane, the way
+        # batch.run_batch only loses the failing vector. returns the lanes
+        # that go on with the instruction
+        if not failed.any():
+            return mask
+        for lane in np.flatnonzero(failed).tolist():
+            self.errors[lane] = f'Error at instruction {instruction_number(self.instruction_positions, self.current)}: {message}'
+        self.running[failed] = False
+        self.full = False
+        return mask & ~failed
+
+    def error(self, message):
+        # wrong for every lane alike (bad operand, jump target, ...)
+        number = instruction_number(self.instruction_positions, getattr(self, 'current', 0))
+        raise RuntimeError(f'Error at instruction {number}: {message}')
+
+_lane_tables = {}
+
+def lane_table(command):
+    # semantics.py tables as numpy arrays, for gathering a whole lane vector
+    table = _lane_tables.get(command)
+    if table is None:
+        source = binary_table(command) if command in BINARY_OPS else unary_table(command)
+        table = _lane_tables[command] = np.frombuffer(source, dtype=np.uint16)
+    return table
+
+def as_index(values):
+    # bytes as unsigned table indices
+    return np.asarray(values).astype(np.uint8).astype(np.intp)
+
+def run_lockstep(ast, input_vectors):
+    # drop-in for batch.run_batch: same output lines (or error, with what
+    # was printed before as .output), one lockstep run. short vectors are
+    # padded, but a lane reading past its own end still fails with
+    # "No input left" like the scalar interpreter
+    input_vectors = [list(vector) for vector in input_vectors]
+    if not input_vectors:
+        return []
+    width = max(len(vector) for vector in input_vectors)
+    inputs = np.zeros((len(input_vectors), width), dtype=np.int16)
+    for lane, vector in enumerate(input_vectors):
+        inputs[lane, :len(vector)] = vector
+    interpreter = VectorInterpreter(ast, inputs=inputs, lanes=len(input_vectors),
+                                    input_lengths=[len(vector) for vector in input_vectors])
+    interpreter.run()
+    results = []
+    for lane, values in enumerate(interpreter.all_outputs()):
+        lines = [str(value) for value in values]
+        if lane in interpreter.errors:
+            error = RuntimeError(interpreter.errors[lane])
+            error.output = lines
+            lines = error
+        results.append(lines)
+    return results
+
+# Example usage
+if __name__ == '__main__':
+    from lexer import Lexer
+    from parser import Parser
+
+    code = '''
+    Var x: byte, y: byte;
+    input(x);
+    input(y);
+    add x, y;
+    print(x);
+    halt;
+    '''
+    ast = Parser(Lexer(code).tokens).parse()
+    interpreter = VectorInterpreter(ast, inputs=[[1, 2], [100, 100], [-5, 5]])
+    interpreter.run()
+    print(interpreter.all_outputs())
@@ -0,0 +1,39 @@
+# read-only state for pool workers. it is set before the pool forks so the
+# children inherit it copy-on-write instead of getting it pickled per task
+_shared = None
+
+def shared():
+    return _shared
+
+def _set_shared(value):
+    global _shared
+    _shared = value
+
+def make_pool(state, processes=None):
+    import multiprocessing  # slow to import, only needed once we go parallel
+    _set_shared(state)
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork').Pool(processes)
+    # no fork here - ship the state once per worker
+    return multiprocessing.get_context().Pool(processes, _set_shared, (state,))
+
+def split_chunks(ast, chunk_size):
+    # cut the ast into runs of about chunk_size instructions. every chunk is
+    # (start, end, number of its first instruction, routine it starts in)
+    chunks = []
+    start = 0
+    count = 0
+    number = 0
+    routine = None
+    chunk_routine = None
+    for position, node in enumerate(ast):
+        if node['type'] == 'instruction':
+            if count == chunk_size:
+                chunks.append((start, position, number - count, chunk_routine))
+                start, count, chunk_routine = position, 0, routine
+            count += 1
+            number += 1
+        elif node['type'] == 'label':
+            routine = node['name']
+    chunks.append((start, len(ast), number - count, chunk_routine))
+    return chunks